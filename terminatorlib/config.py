@@ -73,14 +73,23 @@ KeyError: 'ConfigBase::get_item: unknown key algo'
 
 import platform
 import os
+import marshal
+import json
+import hashlib
 from copy import copy
 from configobj.configobj import ConfigObj, flatten_errors
-from configobj.validate import Validator
 from borg import Borg
+from startupprofile import timed
 from util import dbg, err, DEBUG, get_config_dir, dict_diff
+from version import APP_VERSION
 
 from gi.repository import Gio
 
+# validated config, under get_config_dir(), see ConfigBase.load_cache
+CACHE_FILE = 'config.cache'
+# digest of DEFAULTS, which the configspec is made from, see ConfigBase.cache_key
+DEFAULTS_DIGEST = None
+
 DEFAULTS = {
         'global_config':   {
             'dbus'                  : True,
@@ -120,6 +129,9 @@ DEFAULTS = {
             'title_font'            : 'Sans 9',
             'putty_paste_style'     : False,
             'smart_copy'            : True,
+            'tmux_virtual_scrollback' : False,
+            'spawn_concurrency'     : 4,
+            'lazy_tab_shells'       : False,
         },
         'keybindings': {
             'zoom_in'          : '<Control>plus',
@@ -280,7 +292,10 @@ class Config(object):
 
     def __getitem__(self, key, default=None):
         """Look up a configuration item"""
-        return(self.base.get_item(key, self.profile, default=default))
+        try:
+            return(self.base.get_snapshot(self.profile)[key])
+        except KeyError:
+            return(self.base.get_item(key, self.profile, default=default))
 
     def __setitem__(self, key, value):
         """Set a particular configuration item"""
@@ -301,6 +316,7 @@ class Config(object):
         if not self.base.profiles.has_key(profile):
             dbg('Config::set_profile: %s does not exist, creating' % profile)
             self.base.profiles[profile] = copy(DEFAULTS['profiles']['default'])
+            self.base.invalidate_snapshots()
 
     def add_profile(self, profile):
         """Add a new profile"""
@@ -315,6 +331,7 @@ class Config(object):
             self.set_profile('default')
         if self.base.profiles.has_key(profile):
             del(self.base.profiles[profile])
+            self.base.invalidate_snapshots()
         options = self.options_get()
         if options and options.profile == profile:
             options.profile = None
@@ -325,6 +342,7 @@ class Config(object):
         if self.base.profiles.has_key(profile):
             self.base.profiles[newname] = self.base.profiles[profile]
             del(self.base.profiles[profile])
+            self.base.invalidate_snapshots()
             if profile == self.profile:
                 self.profile = newname
 
@@ -417,7 +435,7 @@ class Config(object):
         # Need to trigger a reconfigure to change active terminals immediately
         if "Terminator" not in globals():
             from terminator import Terminator
-        Terminator().reconfigure()
+        Terminator().reconfigure(['use_system_font', 'title_use_system_font'])
 
     def save(self):
         """Cause ConfigBase to save our config to file"""
@@ -482,6 +500,7 @@ class ConfigBase(Borg):
     keybindings = None
     plugins = None
     layouts = None
+    snapshots = None
     command_line_options = None
 
     def __init__(self):
@@ -516,6 +535,8 @@ class ConfigBase(Borg):
             self.layouts = {}
             for layout in DEFAULTS['layouts']:
                 self.layouts[layout] = copy(DEFAULTS['layouts'][layout])
+        if self.snapshots is None:
+            self.snapshots = {}
 
     def defaults_to_configspec(self):
         """Convert our tree of default values into a ConfigObj validation
@@ -588,6 +609,7 @@ class ConfigBase(Borg):
             configspec.write(open('/tmp/terminator_configspec_debug.txt', 'w'))
         return(configspec)
 
+    @timed('Config.load')
     def load(self):
         """Load configuration data from our various sources"""
         if self.loaded is True:
@@ -602,34 +624,14 @@ class ConfigBase(Borg):
             filename = os.path.join(get_config_dir(), 'config')
 
         dbg('looking for config file: %s' % filename)
-        try:
-            configfile = open(filename, 'r')
-        except Exception, ex:
-            if not self.whined:
-                err('ConfigBase::load: Unable to open %s (%s)' % (filename, ex))
-                self.whined = True
-            return
-        # If we have successfully loaded a config, allow future whining
-        self.whined = False
-
-        try:
-            configspec = self.defaults_to_configspec()
-            parser = ConfigObj(configfile, configspec=configspec)
-            validator = Validator()
-            result = parser.validate(validator, preserve_errors=True)
-        except Exception, ex:
-            err('Unable to load configuration: %s' % ex)
-            return
-
-        if result != True:
-            err('ConfigBase::load: config format is not valid')
-            for (section_list, key, _other) in flatten_errors(parser, result):
-                if key is not None:
-                    err('[%s]: %s is invalid' % (','.join(section_list), key))
-                else:
-                    err('[%s] missing' % ','.join(section_list))
+        parser = self.load_cache(filename)
+        if parser is not None:
+            dbg('using the cached config')
+            self.whined = False
         else:
-            dbg('config validated successfully')
+            parser = self.parse(filename)
+            if parser is None:
+                return
 
         for section_name in self.sections:
             dbg('ConfigBase::load: Processing section: %s' % section_name)
@@ -673,8 +675,84 @@ class ConfigBase(Borg):
                     dbg('ConfigBase::load: skipping missing section %s' %
                             section_name)
 
+        self.invalidate_snapshots()
         self.loaded = True
 
+    def parse(self, filename):
+        """Parse and validate the config file, returning its contents as a
+        dict, or None if it can't be read. A valid config is cached"""
+        try:
+            configfile = open(filename, 'r')
+        except Exception, ex:
+            if not self.whined:
+                err('ConfigBase::load: Unable to open %s (%s)' % (filename, ex))
+                self.whined = True
+            return(None)
+        # If we have successfully loaded a config, allow future whining
+        self.whined = False
+
+        try:
+            from configobj.validate import Validator
+            configspec = self.defaults_to_configspec()
+            parser = ConfigObj(configfile, configspec=configspec)
+            validator = Validator()
+            result = parser.validate(validator, preserve_errors=True)
+        except Exception, ex:
+            err('Unable to load configuration: %s' % ex)
+            return(None)
+
+        if result != True:
+            err('ConfigBase::load: config format is not valid')
+            for (section_list, key, _other) in flatten_errors(parser, result):
+                if key is not None:
+                    err('[%s]: %s is invalid' % (','.join(section_list), key))
+                else:
+                    err('[%s] missing' % ','.join(section_list))
+            return(parser.dict())
+
+        dbg('config validated successfully')
+        parser = parser.dict()
+        self.save_cache(filename, parser)
+        return(parser)
+
+    def cache_key(self, filename):
+        """Identify a version of the config file, and of the code that
+        validated it. The defaults can change without the version, e.g.
+        in a git checkout or a distribution patch"""
+        global DEFAULTS_DIGEST
+        if DEFAULTS_DIGEST is None:
+            DEFAULTS_DIGEST = hashlib.md5(
+                    json.dumps(DEFAULTS, sort_keys=True)).hexdigest()
+        stat = os.stat(filename)
+        return((os.path.realpath(filename), stat.st_mtime, stat.st_size,
+                APP_VERSION, DEFAULTS_DIGEST))
+
+    def load_cache(self, filename):
+        """Return the cached contents of the config file, or None if the
+        file changed since they were cached"""
+        try:
+            key = self.cache_key(filename)
+            with open(os.path.join(get_config_dir(), CACHE_FILE), 'rb') as cache:
+                cached_key, parser = marshal.load(cache)
+        except (IOError, OSError, EOFError, ValueError, TypeError), ex:
+            dbg('no usable config cache: %s' % ex)
+            return(None)
+        if cached_key != key:
+            dbg('config cache is stale')
+            return(None)
+        return(parser)
+
+    def save_cache(self, filename, parser):
+        """Cache the validated contents of the config file"""
+        cachefile = os.path.join(get_config_dir(), CACHE_FILE)
+        try:
+            data = marshal.dumps((self.cache_key(filename), parser))
+            with open(cachefile + '.tmp', 'wb') as cache:
+                cache.write(data)
+            os.rename(cachefile + '.tmp', cachefile)
+        except (IOError, OSError, ValueError), ex:
+            dbg('unable to write config cache: %s' % ex)
+
     def reload(self):
         """Force a reload of the base config"""
         self.loaded = False
@@ -722,28 +800,71 @@ class ConfigBase(Borg):
             profile = 'default'
 
         if self.global_config.has_key(key):
-            dbg('ConfigBase::get_item: %s found in globals: %s' %
-                    (key, self.global_config[key]))
+            dbg('ConfigBase::get_item: %s found in globals: %s',
+                    key, self.global_config[key])
             return(self.global_config[key])
         elif self.profiles[profile].has_key(key):
-            dbg('ConfigBase::get_item: %s found in profile %s: %s' % (
-                    key, profile, self.profiles[profile][key]))
+            dbg('ConfigBase::get_item: %s found in profile %s: %s',
+                    key, profile, self.profiles[profile][key])
             return(self.profiles[profile][key])
         elif key == 'keybindings':
             return(self.keybindings)
         elif plugin and plugin in self.plugins and key in self.plugins[plugin]:
-            dbg('ConfigBase::get_item: %s found in plugin %s: %s' % (
-                    key, plugin, self.plugins[plugin][key]))
+            dbg('ConfigBase::get_item: %s found in plugin %s: %s',
+                    key, plugin, self.plugins[plugin][key])
             return(self.plugins[plugin][key])
         elif default:
             return default
         else:
             raise KeyError('ConfigBase::get_item: unknown key %s' % key)
 
+    def get_snapshot(self, profile):
+        """Return a dict of every item get_item finds for a profile, apart
+        from plugin ones. It is built on first use and shared until the
+        config changes, so it must not be modified"""
+        try:
+            return(self.snapshots[profile])
+        except KeyError:
+            pass
+        dbg('ConfigBase::get_snapshot: Building snapshot of %s', profile)
+        snapshot = {'keybindings': self.keybindings}
+        snapshot.update(self.profiles.get(profile, self.profiles['default']))
+        snapshot.update(self.global_config)
+        self.snapshots[profile] = snapshot
+        return(snapshot)
+
+    def invalidate_snapshots(self):
+        """Throw away the snapshots, the config has changed"""
+        self.snapshots.clear()
+
+    def copy_snapshots(self):
+        """Return a copy of every profile's snapshot, to find what changed
+        since with changed_keys()"""
+        copies = {}
+        for profile in self.profiles:
+            copies[profile] = copy(self.get_snapshot(profile))
+            copies[profile]['keybindings'] = copy(self.keybindings)
+        return(copies)
+
+    def changed_keys(self, copies):
+        """Return a dict of the set of keys that differ from copies in each
+        profile. Profiles copies doesn't have changed entirely, None"""
+        changes = {}
+        for profile in self.profiles:
+            if not copies.has_key(profile):
+                changes[profile] = None
+                continue
+            snapshot = self.get_snapshot(profile)
+            old = copies[profile]
+            changes[profile] = set([key for key in set(snapshot) | set(old)
+                                    if snapshot.get(key) != old.get(key)])
+        return(changes)
+
     def set_item(self, key, value, profile='default', plugin=None):
         """Set a configuration item"""
-        dbg('ConfigBase::set_item: Setting %s=%s (profile=%s, plugin=%s)' %
-                (key, value, profile, plugin))
+        dbg('ConfigBase::set_item: Setting %s=%s (profile=%s, plugin=%s)',
+                key, value, profile, plugin)
+        self.invalidate_snapshots()
 
         if self.global_config.has_key(key):
             self.global_config[key] = value
@@ -779,6 +900,7 @@ class ConfigBase(Borg):
         if profile in self.profiles:
             return(False)
         self.profiles[profile] = copy(DEFAULTS['profiles']['default'])
+        self.invalidate_snapshots()
         return(True)
 
     def add_layout(self, name, layout):
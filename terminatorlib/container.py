@@ -287,7 +287,7 @@ the tab will also close all terminals within it.')
                 page = self.get_nth_page(tabnum)
                 label = self.get_tab_label(page)
                 labels.append(label.get_custom_label())
-                last_active_term.append(self.last_active_term[self.get_nth_page(tabnum)])
+                last_active_term.append(self.last_active_term.get(page))
             layout['labels'] = labels
             layout['last_active_term'] = last_active_term
             layout['active_page'] = self.get_current_page()
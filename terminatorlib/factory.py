@@ -31,6 +31,7 @@ class Factory(Borg):
              'HPaned': 'paned',
              'Paned': 'paned',
              'Notebook': 'notebook',
+             'TabPlaceholder': 'notebook',
              'Container': 'container',
              'Window': 'window'}
     types_keys = types.keys()
@@ -120,3 +121,8 @@ class Factory(Borg):
         import notebook
         return(notebook.Notebook(kwargs['window']))
 
+    def make_tabplaceholder(self, **kwargs):
+        """Make a TabPlaceholder"""
+        import notebook
+        return(notebook.TabPlaceholder(kwargs['layout']))
+
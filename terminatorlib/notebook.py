@@ -14,7 +14,8 @@ from factory import Factory
 from container import Container
 from editablelabel import EditableLabel
 from translation import _
-from util import err, dbg, enumerate_descendants, make_uuid
+from util import err, dbg, enumerate_descendants, make_uuid, \
+        remove_pane_from_layout
 
 class Notebook(Container, Gtk.Notebook):
     """Class implementing a Gtk.Notebook container"""
@@ -101,11 +102,15 @@ class Notebook(Container, Gtk.Notebook):
         num = 0
         keys = children.keys()
         keys.sort(child_compare)
+        maker = Factory()
 
         for child_key in keys:
             child = children[child_key]
             dbg('Making a child of type: %s' % child['type'])
-            if child['type'] == 'Terminal':
+            if not self.get_nth_page(num):
+                # Made below
+                pass
+            elif child['type'] == 'Terminal':
                 pass
             elif child['type'] == 'VPaned':
                 page = self.get_nth_page(num)
@@ -119,15 +124,23 @@ class Notebook(Container, Gtk.Notebook):
         for child_key in keys:
             page = self.get_nth_page(num)
             if not page:
-                # This page does not yet exist, so make it
-                self.newtab(children[child_key])
+                # This page does not yet exist, so make it. When attaching to
+                # tmux only the first tab is built now, the others are
+                # placeholders which get built when they are first shown
+                if self.terminator.tmux_control and \
+                        self.terminator.initial_layout:
+                    self.newtab(widget=maker.make('TabPlaceholder',
+                                                  layout=children[child_key]))
+                else:
+                    self.newtab(children[child_key])
                 page = self.get_nth_page(num)
             if layout.has_key('labels'):
                 labeltext = layout['labels'][num]
                 if labeltext and labeltext != "None":
                     label = self.get_tab_label(page)
                     label.set_custom_label(labeltext)
-            page.create_layout(children[child_key])
+            if not maker.isinstance(page, 'TabPlaceholder'):
+                page.create_layout(children[child_key])
 
             if  layout.get('last_active_term',  None):
                 self.last_active_term[page] = make_uuid(layout['last_active_term'][num])
@@ -189,8 +202,9 @@ class Notebook(Container, Gtk.Notebook):
 
         self.show_all()
 
-        while Gtk.events_pending():
-            Gtk.main_iteration_do(False)
+        if not self.terminator.doing_layout:
+            while Gtk.events_pending():
+                Gtk.main_iteration_do(False)
         self.get_toplevel().set_pos_by_ratio = False
 
         GObject.idle_add(terminal.ensure_visible_and_focussed)
@@ -348,6 +362,11 @@ class Notebook(Container, Gtk.Notebook):
         maker = Factory()
         child = nb.get_nth_page(tabnum)
 
+        if maker.isinstance(child, 'TabPlaceholder'):
+            # Build the tab so that closing it closes its tmux panes
+            nb.materialize_tab(child)
+            child = nb.get_nth_page(tabnum)
+
         if maker.isinstance(child, 'Terminal'):
             dbg('Notebook::closetab: child is a single Terminal')
             del nb.last_active_term[child]
@@ -433,6 +452,9 @@ class Notebook(Container, Gtk.Notebook):
             parent.remove(self)
             self.cnxids.remove_all()
             parent.add(child)
+            if self.terminator.tmux_control:
+                for terminal in parent.get_visible_terminals():
+                    terminal.set_tmux_offscreen(False)
             del(self)
             # Find the last terminal in the new parent and give it focus
             terms = parent.get_visible_terminals()
@@ -489,8 +511,71 @@ class Notebook(Container, Gtk.Notebook):
         self.pending_on_tab_switch = False
         self.pending_on_tab_switch_args = None
 
+    def materialize_tab(self, placeholder):
+        """Replace a TabPlaceholder with the widgets of its layout"""
+        maker = Factory()
+        # Panes closed while the tab was hidden can't be captured, and the
+        # failing capture-pane would take its command sequence with it
+        handler = self.terminator.tmux_control.notifications_handler
+        for pane_id in placeholder.pane_ids[:]:
+            if pane_id in handler.closed_pane_ids:
+                placeholder.remove_pane(pane_id)
+        if not placeholder.pane_ids:
+            dbg('all the panes of the tab were closed')
+            return
+
+        layout = placeholder.layout
+        dbg('building tab for panes: %s, output seen meanwhile: %s' %
+            (placeholder.pane_ids, placeholder.output_bytes))
+
+        metadata = self.get_child_metadata(placeholder)
+        tabnum = metadata['tabnum']
+        placeholder.release()
+        self.remove(placeholder)
+        placeholder.destroy()
+
+        self.newtab(widget=maker.make('Terminal'), metadata=metadata)
+        if layout['type'] == 'VPaned':
+            self.split_axis(self.get_nth_page(tabnum), True)
+        elif layout['type'] == 'HPaned':
+            self.split_axis(self.get_nth_page(tabnum), False)
+        page = self.get_nth_page(tabnum)
+        page.create_layout(layout)
+
+        if maker.isinstance(page, 'Terminal'):
+            terminals = [page]
+        else:
+            terminals = enumerate_descendants(page)[1]
+        for terminal in terminals:
+            terminal.spawn_child()
+        # Panes closed since the last layout change may still be in it
+        self.terminator.tmux_control.garbage_collect_panes()
+
+    def update_tmux_offscreen(self):
+        """Tell the terminals of each tab whether they can be seen"""
+        maker = Factory()
+        current_page = self.get_nth_page(self.get_current_page())
+        for page in self.get_children():
+            if maker.isinstance(page, 'Terminal'):
+                terminals = [page]
+            elif maker.isinstance(page, 'Container'):
+                terminals = enumerate_descendants(page)[1]
+            else:
+                continue
+            for terminal in terminals:
+                terminal.set_tmux_offscreen(page is not current_page)
+
     def on_tab_switch(self, notebook, page,  page_num,  data=None):
         """Do the real work for a tab switch"""
+        maker = Factory()
+        if maker.isinstance(page, 'TabPlaceholder'):
+            if self.page_num(page) != -1:
+                self.materialize_tab(page)
+            return True
+
+        if self.terminator.tmux_control:
+            self.update_tmux_offscreen()
+
         tabs_last_active_term = data['tabs_last_active_term']
         if tabs_last_active_term:
             term = self.terminator.find_terminal_by_uuid(tabs_last_active_term.urn)
@@ -546,6 +631,87 @@ class Notebook(Container, Gtk.Notebook):
                     self.prev_page()
         return True
 
+class TabPlaceholder(Gtk.Box):
+    """Class implementing a stand-in for the contents of a Notebook tab which
+    has not been shown yet. It keeps the layout of the tab, i.e. the tmux pane
+    ids and the ratios of the panes, so the real widgets can be made later"""
+    terminator = None
+    layout = None
+    pane_ids = None
+    output_bytes = None
+
+    def __init__(self, layout):
+        """Class initialiser"""
+        GObject.GObject.__init__(self)
+
+        self.terminator = Terminator()
+        self.layout = layout
+        self.pane_ids = []
+        self.output_bytes = {}
+
+        layouts = [layout]
+        while layouts:
+            item = layouts.pop()
+            if item.has_key('pane_id'):
+                self.pane_ids.append(item['pane_id'])
+            if item.has_key('children'):
+                layouts.extend(item['children'].values())
+
+        for pane_id in self.pane_ids:
+            self.terminator.pane_id_to_placeholder[pane_id] = self
+
+    def count_output(self, pane_id, output):
+        """Record output for one of our panes, which we don't display"""
+        self.output_bytes[pane_id] = self.output_bytes.get(pane_id, 0) + \
+                len(output)
+
+    def remove_pane(self, pane_id):
+        """Forget a pane which has gone away, and our tab if it was the
+        last one"""
+        if self.terminator.pane_id_to_placeholder.get(pane_id) is self:
+            del(self.terminator.pane_id_to_placeholder[pane_id])
+        if pane_id in self.pane_ids:
+            self.pane_ids.remove(pane_id)
+            self.layout = remove_pane_from_layout(self.layout, pane_id)
+        self.output_bytes.pop(pane_id, None)
+
+        if not self.pane_ids:
+            notebook = self.get_parent()
+            if notebook:
+                notebook.remove(self)
+                notebook.hoover()
+            self.destroy()
+
+    def release(self):
+        """Stop standing in for our panes"""
+        for pane_id in self.pane_ids:
+            if self.terminator.pane_id_to_placeholder.get(pane_id) is self:
+                del(self.terminator.pane_id_to_placeholder[pane_id])
+
+    def describe_layout(self, count, parent, global_layout, child_order):
+        """Describe the layout we were made from"""
+        layouts = [(self.layout, parent, child_order)]
+        while layouts:
+            item, item_parent, item_order = layouts.pop()
+            layout = {}
+            for key in item.keys():
+                if key != 'children':
+                    layout[key] = item[key]
+            layout['parent'] = item_parent
+            layout['order'] = item_order
+
+            if item['type'] == 'Terminal':
+                name = 'terminal%d' % count
+            else:
+                name = 'child%d' % count
+            count = count + 1
+            global_layout[name] = layout
+
+            if item.has_key('children'):
+                for child in item['children'].values():
+                    layouts.append((child, name, child['order']))
+        return(count)
+
 class TabLabel(Gtk.HBox):
     """Class implementing a label widget for Notebook tabs"""
     notebook = None
@@ -103,8 +103,18 @@ icon for the window (by file or name)'))
             help=_('Comma separated list of classes to limit debugging to'))
     parser.add_option('--debug-methods', action='store', dest='debug_methods',
             help=_('Comma separated list of methods to limit debugging to'))
+    parser.add_option('--debug-buffer', action='store_true', dest='debug_buffer',
+            help=_('Keep debugging information in memory instead of printing '
+                   'it, SIGUSR1 prints the latest of it'))
     parser.add_option('--new-tab', action='store_true', dest='new_tab',
             help=_('If Terminator is already running, just open a new tab'))
+    parser.add_option('--profile-startup', action='store_true',
+            dest='profile_startup',
+            help=_('Print how long each phase of startup took'))
+    parser.add_option('--profile-startup-file', metavar='FILE',
+            dest='profile_startup_file',
+            help=_('Write how long each phase of startup took to FILE, '
+                   'as JSON'))
     for item in ['--sm-client-id', '--sm-config-prefix', '--screen', '-n',
                  '--no-gconf' ]:
         parser.add_option(item, dest='dummy', action='store',
@@ -119,7 +129,10 @@ icon for the window (by file or name)'))
         print '%s %s' % (version.APP_NAME, version.APP_VERSION)
         sys.exit(0)
 
-    if options.debug_classes or options.debug_methods:
+    if options.profile_startup_file:
+        options.profile_startup = True
+
+    if options.debug_classes or options.debug_methods or options.debug_buffer:
         if not options.debug > 0:
             options.debug = 1
 
@@ -127,14 +140,18 @@ icon for the window (by file or name)'))
         util.DEBUG = True
         if options.debug > 1:
             util.DEBUGFILES = True
+        if options.debug_buffer:
+            util.DEBUGQUIET = True
+        classes = []
+        methods = []
         if options.debug_classes:
-            classes = options.debug_classes.split(',')
-            for item in classes:
-                util.DEBUGCLASSES.append(item.strip())
+            classes = [item.strip() for item in options.debug_classes.split(',')]
         if options.debug_methods:
-            methods = options.debug_methods.split(',')
-            for item in methods:
-                util.DEBUGMETHODS.append(item.strip())
+            methods = [item.strip() for item in options.debug_methods.split(',')]
+        util.set_debug_filters(classes, methods)
+
+    if util.DEBUG:
+        util.dump_debug_log_on_signal()
 
     if options.working_directory:
         if os.path.exists(os.path.expanduser(options.working_directory)):
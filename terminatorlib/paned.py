@@ -73,9 +73,12 @@ class Paned(Container):
 
         self.show_all()
         sibling.grab_focus()
-        
-        while Gtk.events_pending():
-            Gtk.main_iteration_do(False)
+
+        # A layout is built in a hidden window, which is only allocated once
+        # it is complete
+        if not self.terminator.doing_layout:
+            while Gtk.events_pending():
+                Gtk.main_iteration_do(False)
         self.get_toplevel().set_pos_by_ratio = False
 
 
@@ -164,6 +167,8 @@ class Paned(Container):
                     while Gtk.events_pending():
                         Gtk.main_iteration_do(False)
                     self.do_redistribute(*self.last_balance_args)
+            # The handle drag (or rebalance) is over, let tmux know
+            self.terminator.queue_tmux_layout_sync(self)
         return False
 
     def set_autoresize(self, autoresize):
@@ -340,6 +345,7 @@ class Paned(Container):
                 self.set_position(position - fontheight)
             else:
                 self.set_position(position + fontheight)
+            self.terminator.queue_tmux_layout_sync(self)
         elif keyname in ['left', 'right'] and isinstance(self, Gtk.HPaned):
             # This is a key we can handle
             position = self.get_position()
@@ -353,6 +359,7 @@ class Paned(Container):
                 self.set_position(position - fontwidth)
             else:
                 self.set_position(position + fontwidth)
+            self.terminator.queue_tmux_layout_sync(self)
         else:
             # This is not a key we can handle
             self.emit('resize-term', keyname)
@@ -413,9 +420,12 @@ class Paned(Container):
         self.get_child2().create_layout(children[keys[1]])
 
         # Set the position with ratio. For some reason more reliable than by pos.
+        # While a layout is being built we aren't allocated yet, new_size
+        # applies the ratio once the window is shown.
         if layout.has_key('ratio'):
             self.ratio = float(layout['ratio'])
-            self.set_position_by_ratio()
+            if not self.terminator.doing_layout:
+                self.set_position_by_ratio()
 
     def grab_focus(self):
         """We don't want focus, we want a Terminal to have it"""
@@ -29,6 +29,7 @@ import borg
 from config import Config
 from util import dbg, err, get_config_dir
 from terminator import Terminator
+from startupprofile import timed
 
 class Plugin(object):
     """Definition of our base plugin class"""
@@ -48,6 +49,7 @@ class PluginRegistry(borg.Borg):
     instances = None
     path = None
     done = None
+    deferred = None
 
     def __init__(self):
         """Class initialiser"""
@@ -69,9 +71,14 @@ class PluginRegistry(borg.Borg):
             self.done = False
         if not self.available_plugins:
             self.available_plugins = {}
+        if self.deferred is None:
+            self.deferred = []
 
+    @timed('PluginRegistry.load_plugins')
     def load_plugins(self, testing=False):
-        """Load all plugins present in the plugins/ directory in our module"""
+        """Load all plugins present in the plugins/ directory in our module.
+        Unless testing, files that can't hold an enabled plugin are only
+        imported when the list of available plugins is asked for"""
         if self.done:
             dbg('PluginRegistry::load_plugins: Already loaded')
             return
@@ -90,26 +97,48 @@ class PluginRegistry(borg.Borg):
                     continue
                 pluginpath = os.path.join(plugindir, plugin)
                 if os.path.isfile(pluginpath) and plugin[-3:] == '.py':
-                    dbg('PluginRegistry::load_plugins: Importing plugin %s' % 
-                        plugin)
-                    try:
-                        module = __import__(plugin[:-3], None, None, [''])
-                        for item in getattr(module, 'AVAILABLE'):
-                            if item not in self.available_plugins.keys():
-                                func = getattr(module, item)
-                                self.available_plugins[item] = func
-
-                            if not testing and item not in config['enabled_plugins']:
-                                dbg('plugin %s not enabled, skipping' % item)
-                                continue
-                            if item not in self.instances:
-                                self.instances[item] = func()
-                    except Exception, ex:
-                        err('PluginRegistry::load_plugins: Importing plugin %s \
-failed: %s' % (plugin, ex))
+                    if not testing and \
+                       not self.mentions_any(pluginpath, config['enabled_plugins']):
+                        dbg('PluginRegistry::load_plugins: Deferring plugin %s' %
+                            plugin)
+                        self.deferred.append(plugin)
+                        continue
+                    self.import_plugin(plugin, testing)
 
         self.done = True
 
+    def mentions_any(self, pluginpath, names):
+        """Return whether a plugin file contains any of the names. An
+        enabled plugin has to be named in the file that provides it"""
+        try:
+            with open(pluginpath) as pluginfile:
+                source = pluginfile.read()
+        except IOError:
+            return(True)
+        for name in names:
+            if name in source:
+                return(True)
+        return(False)
+
+    def import_plugin(self, plugin, testing=False):
+        """Import a plugin file, and instantiate its enabled plugins"""
+        config = Config()
+        dbg('PluginRegistry::import_plugin: Importing plugin %s' % plugin)
+        try:
+            module = __import__(plugin[:-3], None, None, [''])
+            for item in getattr(module, 'AVAILABLE'):
+                if item not in self.available_plugins.keys():
+                    self.available_plugins[item] = getattr(module, item)
+
+                if not testing and item not in config['enabled_plugins']:
+                    dbg('plugin %s not enabled, skipping' % item)
+                    continue
+                if item not in self.instances:
+                    self.instances[item] = self.available_plugins[item]()
+        except Exception, ex:
+            err('PluginRegistry::import_plugin: Importing plugin %s \
+failed: %s' % (plugin, ex))
+
     def get_plugins_by_capability(self, capability):
         """Return a list of plugins with a particular capability"""
         result = []
@@ -127,6 +156,9 @@ for %s' % (len(self.instances), capability))
     def get_available_plugins(self):
         """Return a list of all available plugins whether they are enabled or
         disabled"""
+        self.load_plugins()
+        while self.deferred:
+            self.import_plugin(self.deferred.pop(0))
         return(self.available_plugins.keys())
 
     def is_enabled(self, plugin):
@@ -0,0 +1,127 @@
+#!/usr/bin/env python2
+# Terminator by Chris Jones <cmsj@tenshu.net>
+# GPL v2 only
+"""rendersettings.py - colours and fonts parsed once per profile
+
+Parsing a profile's palette takes 16 Gdk.RGBA.parse() calls and building the
+256 colour palettes a few hundred more, so the result is kept and shared by
+every terminal using the profile. It is parsed again once any of the config
+items it is made from change, which is only checked when the config snapshot
+of the profile was rebuilt.
+"""
+
+from gi.repository import Gdk, Pango
+from util import dbg
+
+# config items the render settings are made from
+KEYS = ('foreground_color', 'background_color', 'background_type',
+        'background_darkness', 'inactive_color_offset', 'palette',
+        'cursor_color', 'use_system_font', 'font', 'scrollback_lines',
+        'scrollback_infinite')
+
+# RGB values for indices 16..255 copied from vte source in order to dim them
+SHADES = [0, 95, 135, 175, 215, 255]
+
+CACHE = {}
+
+def get_render_settings(config):
+    """Return the RenderSettings of config's profile"""
+    profile = config.get_profile()
+    snapshot = config.base.get_snapshot(profile)
+    settings = CACHE.get(profile)
+    if settings is not None and settings.snapshot is snapshot:
+        return(settings)
+
+    # The config changed since, but maybe not in this profile
+    sources = [config[key] for key in KEYS]
+    if config['use_system_font'] == True:
+        sources.append(config.get_system_mono_font())
+    if settings is None or settings.sources != sources:
+        dbg('rendersettings::get_render_settings: parsing %s', profile)
+        settings = RenderSettings(config, sources)
+        CACHE[profile] = settings
+    settings.snapshot = snapshot
+    return(settings)
+
+def dim(color, factor):
+    """Return a copy of color with its RGB values scaled by factor"""
+    newcolor = color.copy()
+    for bit in ['red', 'green', 'blue']:
+        setattr(newcolor, bit, getattr(color, bit) * factor)
+    return(newcolor)
+
+def background_alpha(config):
+    """Return the alpha of the background colour"""
+    if config['background_type'] == 'transparent':
+        return(config['background_darkness'])
+    return(1)
+
+def rgba(red, green, blue):
+    """Return an opaque Gdk.RGBA of 0-255 components"""
+    newcolor = Gdk.RGBA()
+    newcolor.red = red / 255.0
+    newcolor.green = green / 255.0
+    newcolor.blue = blue / 255.0
+    newcolor.alpha = 1.0
+    return(newcolor)
+
+class RenderSettings(object):
+    """The parsed colours and font of a profile. They are shared by all the
+    terminals using it, so they must not be modified"""
+
+    snapshot = None
+    sources = None
+    factor = None
+    fgcolor_active = None
+    fgcolor_inactive = None
+    bgcolor = None
+    palette_active = None
+    palette_inactive = None
+    cursor_color = None
+    font = None
+    scrollback_lines = None
+
+    def __init__(self, config, sources):
+        """Class initialiser"""
+        self.sources = sources
+
+        self.factor = min(config['inactive_color_offset'], 1.0)
+
+        self.fgcolor_active = Gdk.RGBA()
+        self.fgcolor_active.parse(config['foreground_color'])
+        self.fgcolor_inactive = dim(self.fgcolor_active, self.factor)
+        self.bgcolor = Gdk.RGBA()
+        self.bgcolor.parse(config['background_color'])
+        self.bgcolor.alpha = background_alpha(config)
+
+        colors = config['palette'].split(':')
+        self.palette_active = []
+        for color in colors:
+            if color:
+                newcolor = Gdk.RGBA()
+                newcolor.parse(color)
+                self.palette_active.append(newcolor)
+        if len(colors) == 16:
+            for red in SHADES:
+                for green in SHADES:
+                    for blue in SHADES:
+                        self.palette_active.append(rgba(red, green, blue))
+            for grey in xrange(8, 248, 10):
+                self.palette_active.append(rgba(grey, grey, grey))
+        self.palette_inactive = [dim(color, self.factor)
+                                 for color in self.palette_active]
+
+        self.cursor_color = Gdk.RGBA()
+        self.cursor_color.parse(config['cursor_color'])
+
+        if config['use_system_font'] == True:
+            font = config.get_system_mono_font()
+        else:
+            font = config['font']
+        if font:
+            self.font = Pango.FontDescription(font)
+
+        if config['scrollback_infinite'] == True:
+            self.scrollback_lines = -1
+        else:
+            self.scrollback_lines = config['scrollback_lines']
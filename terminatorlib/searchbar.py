@@ -4,11 +4,120 @@
 """searchbar.py - classes necessary to provide a terminal search bar"""
 
 from gi.repository import Gtk, Gdk
-from gi.repository import GObject
+from gi.repository import GObject, GLib, Vte
+import bisect
 import re
+import threading
+import unicodedata
 
 from translation import _
 from config import Config
+from util import dbg
+
+# PCRE2 compile flags for the regexes handed to VTE
+PCRE2_UTF = 0x00080000
+PCRE2_UCP = 0x00020000
+PCRE2_MULTILINE = 0x00000400
+PCRE2_FLAGS = PCRE2_UTF | PCRE2_UCP | PCRE2_MULTILINE
+
+# number of lines handed to the regex at once by find_matching_rows()
+CHUNK_LINES = 4096
+# number of rows read from the VTE in one go while searching
+BLOCK_ROWS = 2000
+
+def char_cells(char):
+    """Return the number of terminal cells a unicode character takes"""
+    if unicodedata.combining(char):
+        return(0)
+    if unicodedata.east_asian_width(char) in ('W', 'F'):
+        return(2)
+    return(1)
+
+def last_row(text, columns):
+    """Return the row, counted from 0, the last character of a unicode line
+    lands on when it wraps at columns. Wide characters which don't fit at
+    the end of a row move to the next one, as in VTE"""
+    row = 0
+    column = 0
+    for char in text:
+        cells = char_cells(char)
+        if column + cells > columns:
+            row += 1
+            column = 0
+        column += cells
+    return(row)
+
+def find_matching_rows(searchre, lines, columns):
+    """Return the rows, counted from the first one, on which searchre
+    matches lines that wrap at columns, the total number of rows and the
+    number of matches. Lines may be UTF-8 strs, rows are counted in cells"""
+    longre = re.compile('^.{%d,}$' % (columns + 1), re.MULTILINE)
+    # a line of fewer characters than this fits in a row, however wide
+    unicode_longre = re.compile(u'^.{%d,}$' % (columns // 2 + 1),
+                                re.MULTILINE | re.UNICODE)
+    unicode_searchre = None
+    rows = []
+    row = 0
+    matches = 0
+    for chunk_start in xrange(0, len(lines), CHUNK_LINES):
+        chunk = lines[chunk_start:chunk_start + CHUNK_LINES]
+        text = '\n'.join(chunk)
+        try:
+            text.decode('ascii')
+            cells = False
+            chunkre = searchre
+        except UnicodeError:
+            # count the rows by the cells of the characters, not bytes
+            if isinstance(text, str):
+                text = text.decode('utf-8', 'replace')
+            if unicode_searchre is None:
+                pattern = searchre.pattern
+                if isinstance(pattern, str):
+                    pattern = pattern.decode('utf-8', 'replace')
+                unicode_searchre = re.compile(pattern,
+                                              searchre.flags | re.UNICODE)
+            cells = True
+            chunkre = unicode_searchre
+
+        # Lines which wrap, and the extra rows taken by them so far. Both
+        # loops only visit the lines which match, the scanning is left to re
+        wrapped = []
+        extras = []
+        extra = 0
+        line = 0
+        pos = 0
+        for match in (cells and unicode_longre or longre).finditer(text):
+            if cells:
+                line_extra = last_row(match.group(), columns)
+                if not line_extra:
+                    continue
+            else:
+                line_extra = (len(match.group()) - 1) // columns
+            line += text.count('\n', pos, match.start())
+            pos = match.start()
+            extra += line_extra
+            wrapped.append(line)
+            extras.append(extra)
+
+        line = 0
+        pos = 0
+        for match in chunkre.finditer(text):
+            start = match.start()
+            line += text.count('\n', pos, start)
+            pos = start
+            index = bisect.bisect_left(wrapped, line)
+            line_start = text.rfind('\n', 0, start) + 1
+            if cells:
+                line_row = last_row(text[line_start:start + 1], columns)
+            else:
+                line_row = (start - line_start) // columns
+            hit = row + line + (index and extras[index - 1]) + line_row
+            if not rows or rows[-1] != hit:
+                rows.append(hit)
+            matches += 1
+
+        row += len(chunk) + extra
+    return(rows, row, matches)
 
 # pylint: disable-msg=R0904
 class Searchbar(Gtk.HBox):
@@ -32,6 +141,22 @@ class Searchbar(Gtk.HBox):
     searchrow = None
 
     searchits = None
+    native_search = None
+    native_regex = None
+    hits = None
+    matches = None
+
+    snapshot = None
+    snapshot_range = None
+    snapshot_row = None
+    snapshot_generation = None
+    snapshot_scanned = None
+    snapshot_worker = None
+    contents_generation = 0
+    pending_step = None
+
+    tmux_hits = None
+    tmux_hit = None
 
     def __init__(self):
         """Class initialiser"""
@@ -111,6 +236,15 @@ class Searchbar(Gtk.HBox):
         parent = self.get_parent()
         if parent:
             self.vte = parent.vte
+            self.vte.connect('contents-changed', self.on_contents_changed)
+            # VTE 0.46 and later can search itself, with PCRE2
+            self.native_search = hasattr(Vte, 'Regex') and \
+                    hasattr(self.vte, 'search_set_regex')
+
+    def on_contents_changed(self, _vte):
+        """Our copy of the buffer needs reading again before it is searched
+        next"""
+        self.contents_generation += 1
 
     # pylint: disable-msg=W0613
     def search_keypress(self, widget, event):
@@ -139,68 +273,267 @@ class Searchbar(Gtk.HBox):
         if searchtext != self.searchstring:
             self.searchrow = self.get_vte_buffer_range()[0] - 1
             self.searchstring = searchtext
-            self.searchre = re.compile(searchtext)
+            self.searchre = None
+            self.hits = None
+            self.stop_snapshot_worker()
+            self.set_native_regex(None)
+            if self.get_parent().terminator.tmux_control:
+                self.searchre = re.compile(searchtext, re.MULTILINE)
+                self.tmux_search()
+                return
+            if not self.native_search or not self.set_native_regex(searchtext):
+                self.searchre = re.compile(searchtext, re.MULTILINE)
+        elif self.get_parent().terminator.tmux_control and \
+                self.tmux_hits is None:
+            # Still waiting for tmux
+            return
 
         self.reslabel.set_text(_("Searching scrollback"))
         self.next.set_sensitive(True)
         self.prev.set_sensitive(True)
         self.next_search(None)
 
-    def next_search(self, widget):
-        """Search forwards and jump to the next result, if any"""
-        startrow,endrow = self.get_vte_buffer_range()
-        found = startrow <= self.searchrow and self.searchrow < endrow
-        row = self.searchrow
-        while True:
-            row += 1
-            if row >= endrow:
-                if found and self.wrap.get_active():
-                    row = startrow - 1
-                else:
+    def tmux_search(self):
+        """Search the whole tmux history of our terminal. tmux sends it in
+        one go, and it is searched in a thread of its own so that neither
+        the UI nor the tmux output have to wait"""
+        terminal = self.get_parent()
+        searchstring = self.searchstring
+        searchre = self.searchre
+        columns = self.vte.get_column_count()
+        screen_rows = self.vte.get_row_count()
+
+        def search(lines):
+            hits, rows, matches = find_matching_rows(searchre, lines, columns)
+            GObject.idle_add(self.on_tmux_search_done, searchstring, hits,
+                             rows - screen_rows, matches)
+
+        def on_history(lines):
+            thread = threading.Thread(target=search, args=(lines,))
+            thread.setDaemon(True)
+            thread.start()
+
+        self.tmux_hits = None
+        self.tmux_hit = -1
+        self.reslabel.set_text(_("Searching scrollback"))
+        self.next.set_sensitive(False)
+        self.prev.set_sensitive(False)
+        terminal.control.capture_history(terminal.pane_id, on_history)
+
+    def on_tmux_search_done(self, searchstring, hits, screen_top, matches):
+        """Store the hits of a tmux search, as their distance above the
+        screen, and show the first one"""
+        if searchstring != self.searchstring:
+            # The search was changed or ended meanwhile
+            return(False)
+        self.tmux_hits = [screen_top - row for row in hits]
+        self.matches = matches
+        self.tmux_hit = -1
+        self.next.set_sensitive(True)
+        self.prev.set_sensitive(True)
+        self.next_search(None)
+        return(False)
+
+    def tmux_search_step(self, step):
+        """Jump step hits forwards or backwards through a tmux search"""
+        found = 0 <= self.tmux_hit < len(self.tmux_hits)
+        hit = self.tmux_hit + step
+        if not 0 <= hit < len(self.tmux_hits):
+            if found and self.wrap.get_active():
+                hit = hit % len(self.tmux_hits)
+            else:
+                if step > 0:
                     self.prev.set_sensitive(found)
                     self.next.set_sensitive(False)
-                    self.reslabel.set_text(_('No more results'))
-                    return
-            buffer = self.vte.get_text_range(row, 0, row + 1, 0, self.search_character)
-
-            buffer = buffer[0]
-            buffer = buffer[:buffer.find('\n')]
-            matches = self.searchre.search(buffer)
-            if matches:
-                self.searchrow = row
-                self.prev.set_sensitive(True)
-                self.search_hit(self.searchrow)
+                else:
+                    self.next.set_sensitive(found)
+                    self.prev.set_sensitive(False)
+                self.reslabel.set_text(_('No more results'))
                 return
+        self.tmux_hit = hit
+        if step > 0:
+            self.prev.set_sensitive(True)
+        else:
+            self.next.set_sensitive(True)
+
+        adjustment = self.vte.get_vadjustment()
+        self.search_hit(int(adjustment.get_upper() -
+                            adjustment.get_page_size() - self.tmux_hits[hit]))
+
+    def next_search(self, widget):
+        """Search forwards and jump to the next result, if any"""
+        if self.tmux_hits is not None:
+            self.tmux_search_step(1)
+        elif self.native_regex is not None:
+            self.native_search_step(1)
+        else:
+            self.search_step(1)
 
     def prev_search(self, widget):
         """Jump back to the previous search"""
-        startrow,endrow = self.get_vte_buffer_range()
+        if self.tmux_hits is not None:
+            self.tmux_search_step(-1)
+        elif self.native_regex is not None:
+            self.native_search_step(-1)
+        else:
+            self.search_step(-1)
+
+    def set_native_regex(self, searchtext):
+        """Have VTE search for searchtext, or stop searching if it is None.
+        Returns False if VTE can't compile it"""
+        if searchtext is None:
+            if self.native_regex is not None:
+                self.vte.search_set_regex(None, 0)
+                self.native_regex = None
+            return(True)
+        try:
+            regex = Vte.Regex.new_for_search(searchtext, len(searchtext),
+                                             PCRE2_FLAGS)
+        except GLib.GError, ex:
+            dbg('Searchbar::set_native_regex: %s', ex.message)
+            return(False)
+        self.vte.search_set_regex(regex, 0)
+        self.native_regex = regex
+        return(True)
+
+    def native_search_step(self, step):
+        """Have VTE select and show the next (step 1) or previous (step -1)
+        match"""
+        self.vte.search_set_wrap_around(self.wrap.get_active())
+        if step > 0:
+            found = self.vte.search_find_next()
+        else:
+            found = self.vte.search_find_previous()
+        if not found:
+            if step > 0:
+                self.next.set_sensitive(False)
+            else:
+                self.prev.set_sensitive(False)
+            self.reslabel.set_text(_('No more results'))
+            return
+        if step > 0:
+            self.prev.set_sensitive(True)
+        else:
+            self.next.set_sensitive(True)
+        self.reslabel.set_text('')
+
+    def search_step(self, step):
+        """Jump to the next (step 1) or previous (step -1) row matching the
+        search, reading the buffer first if it changed since we last did"""
+        if self.snapshot_worker is None:
+            if self.snapshot is None or \
+               self.snapshot_generation != self.contents_generation:
+                self.read_snapshot()
+            elif self.hits is None:
+                self.scan_snapshot()
+        if self.snapshot_worker is not None:
+            # the step is taken once the reading and scanning is done
+            self.pending_step = step
+            return
+        self.jump_to_hit(step)
+
+    def jump_to_hit(self, step):
+        """Jump step hits forwards or backwards through the snapshot"""
+        startrow, endrow = self.snapshot_range
         found = startrow <= self.searchrow and self.searchrow < endrow
-        row = self.searchrow
-        while True:
-            row -= 1
-            if row <= startrow:
-                if found and self.wrap.get_active():
-                    row = endrow
+        if step > 0:
+            index = bisect.bisect_right(self.hits, self.searchrow)
+        else:
+            index = bisect.bisect_left(self.hits, self.searchrow) - 1
+        if not 0 <= index < len(self.hits):
+            if found and self.wrap.get_active() and self.hits:
+                index = index % len(self.hits)
+            else:
+                if step > 0:
+                    self.prev.set_sensitive(found)
+                    self.next.set_sensitive(False)
                 else:
                     self.next.set_sensitive(found)
                     self.prev.set_sensitive(False)
-                    self.reslabel.set_text(_('No more results'))
-                    return
-            buffer = self.vte.get_text_range(row, 0, row + 1, 0, self.search_character)
-
-            buffer = buffer[0]
-            buffer = buffer[:buffer.find('\n')]
-            matches = self.searchre.search(buffer)
-            if matches:
-                self.searchrow = row
-                self.next.set_sensitive(True)
-                self.search_hit(self.searchrow)
+                self.reslabel.set_text(_('No more results'))
                 return
 
+        self.searchrow = self.hits[index]
+        if step > 0:
+            self.prev.set_sensitive(True)
+        else:
+            self.next.set_sensitive(True)
+        self.search_hit(self.searchrow)
+
+    def read_snapshot(self):
+        """Start reading the buffer and scanning it for the search, a block
+        of rows per idle call. Changes made to the buffer meanwhile are
+        only picked up by the next search step"""
+        startrow, endrow = self.get_vte_buffer_range()
+        self.snapshot = []
+        self.snapshot_range = (startrow, endrow)
+        self.snapshot_row = startrow
+        self.snapshot_generation = self.contents_generation
+        self.scan_snapshot()
+
+    def scan_snapshot(self):
+        """Start scanning the snapshot for the search, a block of rows per
+        idle call"""
+        self.hits = []
+        self.matches = 0
+        self.snapshot_scanned = 0
+        if self.snapshot_worker is None:
+            self.snapshot_worker = GObject.idle_add(self.snapshot_slice)
+
+    def snapshot_slice(self):
+        """Read the next block of rows if there are any left, and scan the
+        next one. Once all of them are, take the pending search step"""
+        startrow, endrow = self.snapshot_range
+        row = self.snapshot_row
+        if row <= endrow:
+            last = min(row + BLOCK_ROWS, endrow + 1)
+            self.snapshot.append((row, self.get_text_rows(row, last)))
+            self.snapshot_row = last
+        if self.snapshot_scanned < len(self.snapshot):
+            self.scan_block(*self.snapshot[self.snapshot_scanned])
+            self.snapshot_scanned += 1
+        if self.snapshot_row <= endrow or \
+           self.snapshot_scanned < len(self.snapshot):
+            return(True)
+
+        self.snapshot_worker = None
+        self.jump_to_hit(self.pending_step)
+        return(False)
+
+    def get_text_rows(self, first, last):
+        """Return the text of the rows from first up to (not including)
+        last, with a newline wherever a line ends"""
+        columns = self.vte.get_column_count()
+        try:
+            return(self.vte.get_text_range(first, 0, last - 1, columns - 1,
+                                           None)[0])
+        except TypeError:
+            # Older bindings insist on the callback
+            return(self.vte.get_text_range(first, 0, last - 1, columns - 1,
+                                           self.search_character)[0])
+
+    def stop_snapshot_worker(self):
+        """Stop reading and scanning the snapshot"""
+        if self.snapshot_worker is not None:
+            GObject.source_remove(self.snapshot_worker)
+            self.snapshot_worker = None
+            # it may be half read
+            self.snapshot = None
+
+    def scan_block(self, row, text):
+        """Add the rows of a block of the buffer, starting at row, that
+        match the search to the hits. Each block is searched on its own, a
+        match can't span two of them"""
+        rows, total, matches = find_matching_rows(self.searchre,
+                                                  text.split('\n'),
+                                                  self.vte.get_column_count())
+        self.hits.extend([row + hit for hit in rows])
+        self.matches += matches
+
     def search_hit(self, row):
         """Update the UI for a search hit"""
-        self.reslabel.set_text("%s %d" % (_('Found at row'), row))
+        self.reslabel.set_text("%s %d (%d %s)" % (_('Found at row'), row,
+                                                  self.matches, _('matches')))
         self.get_parent().scrollbar_jump(row)
         self.next.show()
         self.prev.show()
@@ -223,6 +556,10 @@ class Searchbar(Gtk.HBox):
         self.searchrow = 0
         self.searchstring = None
         self.searchre = None
+        self.hits = None
+        self.tmux_hits = None
+        self.set_native_regex(None)
+        self.stop_snapshot_worker()
         self.reslabel.set_text('')
         self.emit('end-search')
 
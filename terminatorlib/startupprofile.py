@@ -0,0 +1,127 @@
+#!/usr/bin/env python2
+# Terminator by Chris Jones <cmsj@tenshu.net>
+# GPL v2 only
+"""startupprofile.py - time the phases of Terminator's startup
+
+Phases are always timed, which costs a couple of time.time() calls each,
+as most of them happen before the command line has been parsed. With
+--profile-startup the terminator script reports them once the first window
+has been drawn, and the timing stops. Without it the timing stops as soon as
+the options have been parsed.
+
+This module is imported before anything else, so it mustn't import any
+of terminatorlib or Gtk itself.
+
+>>> with phase('outer'):
+...     with phase('inner'):
+...         pass
+>>> [(item['name'], item['depth']) for item in sorted_phases()][-2:]
+[('outer', 0), ('inner', 1)]
+
+"""
+
+import functools
+import json
+import sys
+import time
+
+START = time.time()
+PHASES = []
+DEPTH = 0
+FINISHED = False
+
+def record(name, start, end, depth=0):
+    """Record a phase that took from start to end"""
+    if not FINISHED:
+        PHASES.append({'name': name,
+                       'start': start - START,
+                       'duration': end - start,
+                       'depth': depth})
+
+class phase(object):
+    """Time a named phase of startup, either as a context manager or with
+    explicit start() and stop() calls"""
+
+    name = None
+    began = None
+    depth = None
+
+    def __init__(self, name):
+        """Class initialiser"""
+        self.name = name
+
+    def start(self):
+        """The phase begins"""
+        global DEPTH
+        self.began = time.time()
+        self.depth = DEPTH
+        DEPTH += 1
+
+    def stop(self):
+        """The phase is over"""
+        global DEPTH
+        DEPTH -= 1
+        record(self.name, self.began, time.time(), self.depth)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
+
+def timed(name):
+    """Decorator timing every call of a function as a phase"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if FINISHED:
+                return func(*args, **kwargs)
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def sorted_phases():
+    """Return the phases in the order they began"""
+    return sorted(PHASES, key=lambda item: (item['start'], item['depth']))
+
+def stop():
+    """Stop timing and drop the phases recorded so far, as they will never
+    be reported"""
+    global FINISHED
+    FINISHED = True
+    del PHASES[:]
+
+def report(filename=None):
+    """Stop timing, then print the phases, or write them as JSON"""
+    global FINISHED
+    FINISHED = True
+    total = time.time() - START
+    phases = sorted_phases()
+
+    if filename:
+        with open(filename, 'w') as output:
+            json.dump({'total': total, 'phases': phases}, output, indent=2)
+        return
+
+    print >> sys.stderr, 'Startup took %.1fms' % (total * 1000)
+    print >> sys.stderr, '%10s %10s  %s' % ('start', 'duration', 'phase')
+    for item in phases:
+        print >> sys.stderr, '%8.1fms %8.1fms  %s%s' % (
+                item['start'] * 1000, item['duration'] * 1000,
+                '  ' * item['depth'], item['name'])
+
+def report_on_first_draw(window, filename=None):
+    """Report once window has first been drawn"""
+    first_frame = phase('first frame')
+    first_frame.start()
+
+    def on_draw(widget, _cairo):
+        widget.disconnect(handler)
+        first_frame.stop()
+        report(filename)
+        return False
+
+    handler = window.connect('draw', on_draw)
@@ -7,6 +7,7 @@ from __future__ import division
 from pipes import quote
 import os
 import signal
+import time
 import gi
 from gi.repository import GLib, GObject, Pango, Gtk, Gdk
 gi.require_version('Vte', '2.91')  # vte-0.38 (gnome-3.14)
@@ -21,12 +22,65 @@ from cwd import get_default_cwd
 from factory import Factory
 from terminator import Terminator
 from titlebar import Titlebar
-from terminal_popup_menu import TerminalPopupMenu
 from searchbar import Searchbar
 from translation import _
 from signalman import Signalman
+import rendersettings
+from rendersettings import get_render_settings
+import startupprofile
 import plugin
-from terminatorlib.layoutlauncher import LayoutLauncher
+from terminatorlib.tmux import history
+
+# Compiled URL match regexes, shared by every terminal
+REGEXES = {}
+URL_PATTERNS = None
+
+def get_regex(pattern, flags):
+    """Return pattern compiled with flags, compiling it only the first time"""
+    key = (pattern, int(flags))
+    if not REGEXES.has_key(key):
+        dbg('get_regex: compiling %s', pattern)
+        REGEXES[key] = GLib.Regex.new(pattern, flags, 0)
+    return(REGEXES[key])
+
+def get_url_patterns():
+    """Return a list of the names and patterns of our built in URL matches,
+    the full URI one first"""
+    global URL_PATTERNS
+    if URL_PATTERNS is not None:
+        return(URL_PATTERNS)
+
+    userchars = "-A-Za-z0-9"
+    passchars = "-A-Za-z0-9,?;.:/!%$^*&~\"#'"
+    hostchars = "-A-Za-z0-9:\[\]"
+    pathchars = "-A-Za-z0-9_$.+!*(),;:@&=?/~#%'"
+    schemes   = "(news:|telnet:|nntp:|file:/|https?:|ftps?:|webcal:)"
+    user      = "[" + userchars + "]+(:[" + passchars + "]+)?"
+    urlpath   = "/[" + pathchars + "]*[^]'.}>) \t\r\n,\\\"]"
+
+    lboundry = "\\b"
+    rboundry = "\\b"
+
+    URL_PATTERNS = [
+        ('full_uri', lboundry + schemes +
+            "//(" + user + "@)?[" + hostchars  +".]+(:[0-9]+)?(" + 
+            urlpath + ")?" + rboundry + "/?"),
+        ('voip', lboundry +
+            '(callto:|h323:|sip:)' + "[" + userchars + "+][" + 
+            userchars + ".]*(:[0-9]+)?@?[" + pathchars + "]+" + 
+            rboundry),
+        ('addr_only', lboundry +
+            "(www|ftp)[" + hostchars + "]*\.[" + hostchars + 
+            ".]+(:[0-9]+)?(" + urlpath + ")?" + rboundry + "/?"),
+        ('email', lboundry +
+            "(mailto:)?[a-zA-Z0-9][a-zA-Z0-9.+-]*@[a-zA-Z0-9]" +
+            "[a-zA-Z0-9-]*\.[a-zA-Z0-9][a-zA-Z0-9-]+" +
+            "[.a-zA-Z0-9-]*" + rboundry),
+        ('nntp', lboundry +
+            """news:[-A-Z\^_a-z{|}~!"#$%&'()*+,./0-9;:=?`]+@""" +
+            "[-A-Za-z0-9.]+(:[0-9]+)?" + rboundry),
+    ]
+    return(URL_PATTERNS)
 
 # pylint: disable-msg=R0904
 class Terminal(Gtk.VBox):
@@ -68,6 +122,11 @@ class Terminal(Gtk.VBox):
             (GObject.TYPE_STRING,)),
     }
 
+    # config items the colours of the VTE are made from
+    COLOR_KEYS = ('use_theme_colors', 'foreground_color', 'background_color',
+                  'background_type', 'background_darkness',
+                  'inactive_color_offset', 'palette')
+
     TARGET_TYPE_VTE = 8
     TARGET_TYPE_MOZ = 9
 
@@ -88,6 +147,10 @@ class Terminal(Gtk.VBox):
     command = None
     clipboard = None
     pid = None
+    spawn_args = None
+    spawn_queued = None
+    spawn_latency = None
+    spawn_deferred = False
 
     matches = None
     regex_flags = None
@@ -111,6 +174,14 @@ class Terminal(Gtk.VBox):
 
     control = None
     pane_id = None
+    tmux_offscreen = False
+    tmux_missed_output = False
+    tmux_catching_up = False
+    tmux_history = None
+    tmux_history_lines = 0
+    tmux_history_pages = 0
+    tmux_history_size = None
+    tmux_history_loading = False
 
     def __init__(self):
         """Class initialiser"""
@@ -263,75 +334,39 @@ class Terminal(Gtk.VBox):
 
     def update_url_matches(self):
         """Update the regexps used to match URLs"""
-        userchars = "-A-Za-z0-9"
-        passchars = "-A-Za-z0-9,?;.:/!%$^*&~\"#'"
-        hostchars = "-A-Za-z0-9:\[\]"
-        pathchars = "-A-Za-z0-9_$.+!*(),;:@&=?/~#%'"
-        schemes   = "(news:|telnet:|nntp:|file:/|https?:|ftps?:|webcal:)"
-        user      = "[" + userchars + "]+(:[" + passchars + "]+)?"
-        urlpath   = "/[" + pathchars + "]*[^]'.}>) \t\r\n,\\\"]"
-
-        lboundry = "\\b"
-        rboundry = "\\b"
-
-        re = (lboundry + schemes +
-                "//(" + user + "@)?[" + hostchars  +".]+(:[0-9]+)?(" + 
-                urlpath + ")?" + rboundry + "/?")
-        reg = GLib.Regex.new(re, self.regex_flags, 0)
-        self.matches['full_uri'] = self.vte.match_add_gregex(reg, 0)
-
-        if self.matches['full_uri'] == -1:
-            err ('Terminal::update_url_matches: Failed adding URL matches')
-        else:
-            re = (lboundry +
-                    '(callto:|h323:|sip:)' + "[" + userchars + "+][" + 
-                    userchars + ".]*(:[0-9]+)?@?[" + pathchars + "]+" + 
-                    rboundry)
-            reg = GLib.Regex.new(re, self.regex_flags, 0)
-            self.matches['voip'] = self.vte.match_add_gregex(reg, 0)
-            re = (lboundry +
-                    "(www|ftp)[" + hostchars + "]*\.[" + hostchars + 
-                    ".]+(:[0-9]+)?(" + urlpath + ")?" + rboundry + "/?")
-            reg = GLib.Regex.new(re, self.regex_flags, 0)
-            self.matches['addr_only'] = self.vte.match_add_gregex(reg, 0)
-            re = (lboundry +
-                    "(mailto:)?[a-zA-Z0-9][a-zA-Z0-9.+-]*@[a-zA-Z0-9]" +
-                            "[a-zA-Z0-9-]*\.[a-zA-Z0-9][a-zA-Z0-9-]+" +
-                            "[.a-zA-Z0-9-]*" + rboundry)
-            reg = GLib.Regex.new(re, self.regex_flags, 0)
-            self.matches['email'] = self.vte.match_add_gregex(reg, 0)
-            re = (lboundry +
-                  """news:[-A-Z\^_a-z{|}~!"#$%&'()*+,./0-9;:=?`]+@""" +
-                            "[-A-Za-z0-9.]+(:[0-9]+)?" + rboundry)
-            reg = GLib.Regex.new(re, self.regex_flags, 0)
-            self.matches['nntp'] = self.vte.match_add_gregex(reg, 0)
-
-            # Now add any matches from plugins
-            try:
-                registry = plugin.PluginRegistry()
-                registry.load_plugins()
-                plugins = registry.get_plugins_by_capability('url_handler')
+        for name, pattern in get_url_patterns():
+            self.matches[name] = self.vte.match_add_gregex(
+                    get_regex(pattern, self.regex_flags), 0)
+            # Only the full URI match failing stops the others being added
+            if name == 'full_uri' and self.matches[name] == -1:
+                err ('Terminal::update_url_matches: Failed adding URL matches')
+                return
 
-                for urlplugin in plugins:
-                    name = urlplugin.handler_name
-                    match = urlplugin.match
-                    if name in self.matches:
-                        dbg('refusing to add duplicate match %s' % name)
-                        continue
-                    reg = GLib.Regex.new(match, self.regex_flags, 0)
-                    self.matches[name] = self.vte.match_add_gregex(reg, 0)
-                    dbg('added plugin URL handler for %s (%s) as %d' % 
-                        (name, urlplugin.__class__.__name__,
-                        self.matches[name]))
-            except Exception, ex:
-                err('Exception occurred adding plugin URL match: %s' % ex)
+        # Now add any matches from plugins
+        try:
+            registry = plugin.PluginRegistry()
+            registry.load_plugins()
+            plugins = registry.get_plugins_by_capability('url_handler')
+
+            for urlplugin in plugins:
+                name = urlplugin.handler_name
+                match = urlplugin.match
+                if name in self.matches:
+                    dbg('refusing to add duplicate match %s', name)
+                    continue
+                reg = get_regex(match, self.regex_flags)
+                self.matches[name] = self.vte.match_add_gregex(reg, 0)
+                dbg('added plugin URL handler for %s (%s) as %d', name,
+                    urlplugin.__class__.__name__, self.matches[name])
+        except Exception, ex:
+            err('Exception occurred adding plugin URL match: %s' % ex)
 
     def match_add(self, name, match):
         """Register a URL match"""
         if name in self.matches:
             err('Terminal::match_add: Refusing to create duplicate match %s' % name)
             return
-        reg = GLib.Regex.new(match, self.regex_flags, 0)
+        reg = get_regex(match, self.regex_flags)
         self.matches[name] = self.vte.match_add_gregex(reg, 0)
 
     def match_remove(self, name):
@@ -606,200 +641,177 @@ class Terminal(Gtk.VBox):
         """Toggle the autocleangroups mode"""
         self.config['autoclean_groups'] = not self.config['autoclean_groups']
 
-    def reconfigure(self, _widget=None):
-        """Reconfigure our settings"""
-        dbg('Terminal::reconfigure')
+    def reconfigure(self, _widget=None, changed=None):
+        """Reconfigure our settings. changed is the set of config keys that
+        changed since the last time, only the settings using them are applied
+        again. None applies all of them"""
+        dbg('Terminal::reconfigure: %s', changed)
         self.cnxids.remove_signal(self.vte, 'realize')
 
-        # Handle child command exiting
-        self.cnxids.remove_signal(self.vte, 'child-exited')
+        def wants(*keys):
+            """Do any of keys need to be applied"""
+            return(changed is None or not changed.isdisjoint(keys))
 
-        if self.config['exit_action'] == 'restart':
-            self.cnxids.new(self.vte, 'child-exited', self.spawn_child, True)
-        elif self.config['exit_action'] in ('close', 'left'):
-            self.cnxids.new(self.vte, 'child-exited', 
+        # Handle child command exiting
+        if wants('exit_action'):
+            self.cnxids.remove_signal(self.vte, 'child-exited')
+            if self.config['exit_action'] == 'restart':
+                self.cnxids.new(self.vte, 'child-exited', self.spawn_child, True)
+            elif self.config['exit_action'] in ('close', 'left'):
+                self.cnxids.new(self.vte, 'child-exited', 
                                             lambda x, y: self.emit('close-term'))
 
-        if self.custom_encoding != True:
+        if self.custom_encoding != True and wants('encoding'):
             self.vte.set_encoding(self.config['encoding'])
         # Word char support was missing from vte 0.38, silently skip this setting
-        if hasattr(self.vte, 'set_word_char_exceptions'):
+        if hasattr(self.vte, 'set_word_char_exceptions') and \
+           wants('word_chars'):
             self.vte.set_word_char_exceptions(self.config['word_chars'])
-        self.vte.set_mouse_autohide(self.config['mouse_autohide'])
+        if wants('mouse_autohide'):
+            self.vte.set_mouse_autohide(self.config['mouse_autohide'])
 
-        backspace = self.config['backspace_binding']
-        delete = self.config['delete_binding']
+        if wants('backspace_binding', 'delete_binding'):
+            backspace = self.config['backspace_binding']
+            delete = self.config['delete_binding']
 
-        try:
-            if backspace == 'ascii-del':
-                backbind = Vte.ERASE_ASCII_DELETE
-            elif backspace == 'control-h':
-                backbind = Vte.ERASE_ASCII_BACKSPACE
-            elif backspace == 'escape-sequence':
-                backbind = Vte.ERASE_DELETE_SEQUENCE
+            try:
+                if backspace == 'ascii-del':
+                    backbind = Vte.ERASE_ASCII_DELETE
+                elif backspace == 'control-h':
+                    backbind = Vte.ERASE_ASCII_BACKSPACE
+                elif backspace == 'escape-sequence':
+                    backbind = Vte.ERASE_DELETE_SEQUENCE
+                else:
+                    backbind = Vte.ERASE_AUTO
+            except AttributeError:
+                if backspace == 'ascii-del':
+                    backbind = 2
+                elif backspace == 'control-h':
+                    backbind = 1
+                elif backspace == 'escape-sequence':
+                    backbind = 3
+                else:
+                    backbind = 0
+
+            try:
+                if delete == 'ascii-del':
+                    delbind = Vte.ERASE_ASCII_DELETE
+                elif delete == 'control-h':
+                    delbind = Vte.ERASE_ASCII_BACKSPACE
+                elif delete == 'escape-sequence':
+                    delbind = Vte.ERASE_DELETE_SEQUENCE
+                else:
+                    delbind = Vte.ERASE_AUTO
+            except AttributeError:
+                if delete == 'ascii-del':
+                    delbind = 2
+                elif delete == 'control-h':
+                    delbind = 1
+                elif delete == 'escape-sequence':
+                    delbind = 3
+                else:
+                    delbind = 0
+
+            self.vte.set_backspace_binding(backbind)
+            self.vte.set_delete_binding(delbind)
+
+        if not self.custom_font_size and wants('use_system_font', 'font'):
+            font = get_render_settings(self.config).font
+            if font:
+                self.set_font(font)
+        if wants('allow_bold'):
+            self.vte.set_allow_bold(self.config['allow_bold'])
+        if wants(*self.COLOR_KEYS):
+            render = get_render_settings(self.config)
+            if self.config['use_theme_colors']:
+                self.fgcolor_active = self.vte.get_style_context().get_color(Gtk.StateType.NORMAL)  # VERIFY FOR GTK3: do these really take the theme colors?
+                self.fgcolor_inactive = rendersettings.dim(self.fgcolor_active,
+                                                           render.factor)
+                self.bgcolor = self.vte.get_style_context().get_background_color(Gtk.StateType.NORMAL)
+                self.bgcolor.alpha = rendersettings.background_alpha(self.config)
             else:
-                backbind = Vte.ERASE_AUTO
-        except AttributeError:
-            if backspace == 'ascii-del':
-                backbind = 2
-            elif backspace == 'control-h':
-                backbind = 1
-            elif backspace == 'escape-sequence':
-                backbind = 3
+                self.fgcolor_active = render.fgcolor_active
+                self.fgcolor_inactive = render.fgcolor_inactive
+                self.bgcolor = render.bgcolor
+            self.palette_active = render.palette_active
+            self.palette_inactive = render.palette_inactive
+            if self.terminator.last_focused_term == self:
+                self.vte.set_colors(self.fgcolor_active, self.bgcolor,
+                                    self.palette_active)
+            else:
+                self.vte.set_colors(self.fgcolor_inactive, self.bgcolor,
+                                    self.palette_inactive)
+
+        # The CSS class only changes along with our profile
+        if changed is None:
+            profiles = self.config.base.profiles
+            terminal_box_style_context = self.terminalbox.get_style_context()
+            for profile in profiles.keys():
+                munged_profile = "terminator-profile-%s" % (
+                    "".join([c if c.isalnum() else "-" for c in profile]))
+                if terminal_box_style_context.has_class(munged_profile):
+                    terminal_box_style_context.remove_class(munged_profile)
+            munged_profile = "".join([c if c.isalnum() else "-" for c in self.get_profile()])
+            css_class_name = "terminator-profile-%s" % (munged_profile)
+            terminal_box_style_context.add_class(css_class_name)
+
+        if wants('cursor_color_fg', 'cursor_color', 'cursor_shape',
+                 'cursor_blink'):
+            self.set_cursor_color()
+            self.vte.set_cursor_shape(getattr(Vte.CursorShape,
+                                              self.config['cursor_shape'].upper()));
+
+            if self.config['cursor_blink'] == True:
+                self.vte.set_cursor_blink_mode(Vte.CursorBlinkMode.ON)
             else:
-                backbind = 0
+                self.vte.set_cursor_blink_mode(Vte.CursorBlinkMode.OFF)
 
-        try:
-            if delete == 'ascii-del':
-                delbind = Vte.ERASE_ASCII_DELETE
-            elif delete == 'control-h':
-                delbind = Vte.ERASE_ASCII_BACKSPACE
-            elif delete == 'escape-sequence':
-                delbind = Vte.ERASE_DELETE_SEQUENCE
+        if wants('force_no_bell', 'audible_bell', 'urgent_bell', 'icon_bell',
+                 'visible_bell'):
+            if self.config['force_no_bell'] == True:
+                self.vte.set_audible_bell(False)
+                self.cnxids.remove_signal(self.vte, 'bell')
             else:
-                delbind = Vte.ERASE_AUTO
-        except AttributeError:
-            if delete == 'ascii-del':
-                delbind = 2
-            elif delete == 'control-h':
-                delbind = 1
-            elif delete == 'escape-sequence':
-                delbind = 3
+                self.vte.set_audible_bell(self.config['audible_bell'])
+                self.cnxids.remove_signal(self.vte, 'bell')
+                if self.config['urgent_bell'] == True or \
+                   self.config['icon_bell'] == True or \
+                   self.config['visible_bell'] == True:
+                    try:
+                        self.cnxids.new(self.vte, 'bell', self.on_bell)
+                    except TypeError:
+                        err('bell signal unavailable with this version of VTE')
+
+        if wants('scrollback_lines', 'scrollback_infinite'):
+            if self.tmux_virtual_scrollback():
+                # tmux keeps the history, we only hold the recent part of it
+                # and whatever was fetched with load_tmux_history()
+                scrollback_lines = self.config['scrollback_lines'] + \
+                        self.tmux_history_lines
             else:
-                delbind = 0
-
-        self.vte.set_backspace_binding(backbind)
-        self.vte.set_delete_binding(delbind)
-
-        if not self.custom_font_size:
-            try:
-                if self.config['use_system_font'] == True:
-                    font = self.config.get_system_mono_font()
-                else:
-                    font = self.config['font']
-                self.set_font(Pango.FontDescription(font))
-            except:
-                pass
-        self.vte.set_allow_bold(self.config['allow_bold'])
-        if self.config['use_theme_colors']:
-            self.fgcolor_active = self.vte.get_style_context().get_color(Gtk.StateType.NORMAL)  # VERIFY FOR GTK3: do these really take the theme colors?
-            self.bgcolor = self.vte.get_style_context().get_background_color(Gtk.StateType.NORMAL)
-        else:
-            self.fgcolor_active = Gdk.RGBA()
-            self.fgcolor_active.parse(self.config['foreground_color'])
-            self.bgcolor = Gdk.RGBA()
-            self.bgcolor.parse(self.config['background_color'])
-
-        if self.config['background_type'] == 'transparent':
-            self.bgcolor.alpha = self.config['background_darkness']
-        else:
-            self.bgcolor.alpha = 1
-
-        factor = self.config['inactive_color_offset']
-        if factor > 1.0:
-          factor = 1.0
-        self.fgcolor_inactive = self.fgcolor_active.copy()
-        dbg(("fgcolor_inactive set to: RGB(%s,%s,%s)", getattr(self.fgcolor_inactive, "red"),
-                                                      getattr(self.fgcolor_inactive, "green"),
-                                                      getattr(self.fgcolor_inactive, "blue")))
-
-        for bit in ['red', 'green', 'blue']:
-            setattr(self.fgcolor_inactive, bit,
-                    getattr(self.fgcolor_inactive, bit) * factor)
-
-        dbg(("fgcolor_inactive set to: RGB(%s,%s,%s)", getattr(self.fgcolor_inactive, "red"),
-                                                      getattr(self.fgcolor_inactive, "green"),
-                                                      getattr(self.fgcolor_inactive, "blue")))
-        colors = self.config['palette'].split(':')
-        self.palette_active = []
-        for color in colors:
-            if color:
-                newcolor = Gdk.RGBA()
-                newcolor.parse(color)
-                self.palette_active.append(newcolor)
-        if len(colors) == 16:
-            # RGB values for indices 16..255 copied from vte source in order to dim them
-            shades = [0, 95, 135, 175, 215, 255]
-            for r in xrange(0, 6):
-                for g in xrange(0, 6):
-                    for b in xrange(0, 6):
-                        newcolor = Gdk.RGBA()
-                        setattr(newcolor, "red",   shades[r] / 255.0)
-                        setattr(newcolor, "green", shades[g] / 255.0)
-                        setattr(newcolor, "blue",  shades[b] / 255.0)
-                        self.palette_active.append(newcolor)
-            for y in xrange(8, 248, 10):
-                newcolor = Gdk.RGBA()
-                setattr(newcolor, "red",   y / 255.0)
-                setattr(newcolor, "green", y / 255.0)
-                setattr(newcolor, "blue",  y / 255.0)
-                self.palette_active.append(newcolor)        
-        self.palette_inactive = []
-        for color in self.palette_active:
-            newcolor = Gdk.RGBA()
-            for bit in ['red', 'green', 'blue']:
-                setattr(newcolor, bit,
-                        getattr(color, bit) * factor)
-            self.palette_inactive.append(newcolor)
-        if self.terminator.last_focused_term == self:
-            self.vte.set_colors(self.fgcolor_active, self.bgcolor,
-                                self.palette_active)
-        else:
-            self.vte.set_colors(self.fgcolor_inactive, self.bgcolor,
-                                self.palette_inactive)
-        profiles = self.config.base.profiles
-        terminal_box_style_context = self.terminalbox.get_style_context()
-        for profile in profiles.keys():
-            munged_profile = "terminator-profile-%s" % (
-                "".join([c if c.isalnum() else "-" for c in profile]))
-            if terminal_box_style_context.has_class(munged_profile):
-                terminal_box_style_context.remove_class(munged_profile)
-        munged_profile = "".join([c if c.isalnum() else "-" for c in self.get_profile()])
-        css_class_name = "terminator-profile-%s" % (munged_profile)
-        terminal_box_style_context.add_class(css_class_name)
-        self.set_cursor_color()
-        self.vte.set_cursor_shape(getattr(Vte.CursorShape,
-                                          self.config['cursor_shape'].upper()));
-
-        if self.config['cursor_blink'] == True:
-            self.vte.set_cursor_blink_mode(Vte.CursorBlinkMode.ON)
-        else:
-            self.vte.set_cursor_blink_mode(Vte.CursorBlinkMode.OFF)
-
-        if self.config['force_no_bell'] == True:
-            self.vte.set_audible_bell(False)
-            self.cnxids.remove_signal(self.vte, 'bell')
-        else:
-            self.vte.set_audible_bell(self.config['audible_bell'])
-            self.cnxids.remove_signal(self.vte, 'bell')
-            if self.config['urgent_bell'] == True or \
-               self.config['icon_bell'] == True or \
-               self.config['visible_bell'] == True:
-                try:
-                    self.cnxids.new(self.vte, 'bell', self.on_bell)
-                except TypeError:
-                    err('bell signal unavailable with this version of VTE')
-
-        if self.config['scrollback_infinite'] == True:
-            scrollback_lines = -1
-        else:
-            scrollback_lines = self.config['scrollback_lines']
-        self.vte.set_scrollback_lines(scrollback_lines)
-        self.vte.set_scroll_on_keystroke(self.config['scroll_on_keystroke'])
-        self.vte.set_scroll_on_output(self.config['scroll_on_output'])
-
-        if self.config['scrollbar_position'] in ['disabled', 'hidden']:
-            self.scrollbar.hide()
-        else:
-            self.scrollbar.show()
-            if self.config['scrollbar_position'] == 'left':
-                self.terminalbox.reorder_child(self.scrollbar, 0)
-            elif self.config['scrollbar_position'] == 'right':
-                self.terminalbox.reorder_child(self.vte, 0)
+                scrollback_lines = \
+                        get_render_settings(self.config).scrollback_lines
+            self.vte.set_scrollback_lines(scrollback_lines)
+        if wants('scroll_on_keystroke'):
+            self.vte.set_scroll_on_keystroke(self.config['scroll_on_keystroke'])
+        if wants('scroll_on_output'):
+            self.vte.set_scroll_on_output(self.config['scroll_on_output'])
+
+        if wants('scrollbar_position'):
+            if self.config['scrollbar_position'] in ['disabled', 'hidden']:
+                self.scrollbar.hide()
+            else:
+                self.scrollbar.show()
+                if self.config['scrollbar_position'] == 'left':
+                    self.terminalbox.reorder_child(self.scrollbar, 0)
+                elif self.config['scrollbar_position'] == 'right':
+                    self.terminalbox.reorder_child(self.vte, 0)
 
-        self.vte.set_rewrap_on_resize(self.config['rewrap_on_resize'])
+        if wants('rewrap_on_resize'):
+            self.vte.set_rewrap_on_resize(self.config['rewrap_on_resize'])
 
-        self.titlebar.update()
+        if changed is None or [key for key in changed if key.startswith('title')]:
+            self.titlebar.update()
         self.vte.queue_draw()
 
     def set_cursor_color(self):
@@ -807,9 +819,8 @@ class Terminal(Gtk.VBox):
         if self.config['cursor_color_fg']:
             self.vte.set_color_cursor(None) 
         else:
-            cursor_color = Gdk.RGBA()
-            cursor_color.parse(self.config['cursor_color'])
-            self.vte.set_color_cursor(cursor_color)
+            self.vte.set_color_cursor(
+                    get_render_settings(self.config).cursor_color)
 
     def get_window_title(self):
         """Return the window title"""
@@ -860,10 +871,13 @@ class Terminal(Gtk.VBox):
             dbg('Terminal::on_keypress: Called on %s with no event' % widget)
             return(False)
 
+        if self.spawn_deferred:
+            self.start_deferred_spawn()
+
         # Workaround for IBus interfering with broadcast when using dead keys
         # Environment also needs IBUS_DISABLE_SNOOPER=1, or double chars appear
         # in the receivers.
-        if self.terminator.ibus_running:
+        if self.terminator.is_ibus_running():
             if (event.state | Gdk.ModifierType.MODIFIER_MASK ) ^ Gdk.ModifierType.MODIFIER_MASK != 0:
                 dbg('Terminal::on_keypress: Ingore processed event with event.state %d' % event.state)
                 return(False)
@@ -985,11 +999,24 @@ class Terminal(Gtk.VBox):
                 return (True)
 
         if self.terminator.tmux_control:
-            return self.control.send_mousewheel(event, pane_id=self.pane_id)
+            if self.control.send_mousewheel(event, pane_id=self.pane_id):
+                return(True)
+            if self.tmux_virtual_scrollback():
+                adjustment = self.vte.get_vadjustment()
+                if event.direction == Gdk.ScrollDirection.UP or SMOOTH_SCROLL_UP:
+                    if adjustment.get_value() <= adjustment.get_lower() and \
+                       not self.tmux_history_exhausted():
+                        # Scrolled past what we have, get more from tmux
+                        self.load_tmux_history(self.tmux_history_pages + 1)
+                elif self.tmux_history_pages and adjustment.get_value() >= \
+                        adjustment.get_upper() - adjustment.get_page_size():
+                    # Back at the bottom, let go of the fetched history
+                    self.set_tmux_history(0, 0)
         return(False)
 
     def popup_menu(self, widget, event=None):
         """Display the context menu"""
+        from terminal_popup_menu import TerminalPopupMenu
         menu = TerminalPopupMenu(self)
         menu.show(widget, event)
 
@@ -1240,8 +1267,64 @@ class Terminal(Gtk.VBox):
 
     def scrollbar_jump(self, position):
         """Move the scrollbar to a particular row"""
+        adjustment = self.vte.get_vadjustment()
+        if self.tmux_virtual_scrollback() and \
+                position < adjustment.get_lower():
+            # The row is only in the tmux history
+            distance = int(adjustment.get_upper() -
+                           adjustment.get_page_size() - position)
+            beyond = max(distance - self.config['scrollback_lines'], 0)
+            self.load_tmux_history(beyond // history.PAGE_LINES + 1, distance)
+            return
         self.scrollbar.set_value(position)
 
+    def tmux_virtual_scrollback(self):
+        """Return True if our history is kept by tmux and only fetched
+        when it is scrolled to"""
+        return(bool(self.terminator.tmux_control and
+                    self.config['tmux_virtual_scrollback']))
+
+    def load_tmux_history(self, pages, distance=None):
+        """Refill the VTE with pages of the tmux history above the screen,
+        then scroll to the line distance lines above the screen (by default
+        the line currently at the top)"""
+        if self.tmux_history_loading:
+            return
+        if self.tmux_history is None:
+            self.tmux_history = history.HistoryCache()
+        if distance is None:
+            adjustment = self.vte.get_vadjustment()
+            distance = int(adjustment.get_upper() -
+                           adjustment.get_page_size() -
+                           adjustment.get_value())
+        self.tmux_history_loading = True
+        # the scrollback we keep anyway holds the rows right above the
+        # screen, the pages start above those
+        self.control.load_history(self.pane_id, pages, self.tmux_history,
+                                  distance, self.config['scrollback_lines'])
+
+    def tmux_history_exhausted(self):
+        """Return True if the pages loaded reach the start of the tmux
+        history, as far as we know"""
+        return(self.tmux_history_size is not None and
+               self.config['scrollback_lines'] + self.tmux_history_pages *
+               history.PAGE_LINES >= self.tmux_history_size)
+
+    def set_tmux_history(self, pages, lines):
+        """Make room in the VTE scrollback for pages of tmux history, lines
+        rows in all"""
+        self.tmux_history_pages = pages
+        self.tmux_history_lines = lines
+        self.vte.set_scrollback_lines(self.config['scrollback_lines'] + lines)
+
+    def scroll_to_tmux_history(self, distance):
+        """Scroll to the line distance lines above the screen"""
+        adjustment = self.vte.get_vadjustment()
+        self.scrollbar.set_value(max(adjustment.get_lower(),
+                                     adjustment.get_upper() -
+                                     adjustment.get_page_size() - distance))
+        return(False)
+
     def on_search_done(self, _widget):
         """We've finished searching, so clean up"""
         self.searchbar.hide()
@@ -1270,7 +1353,6 @@ class Terminal(Gtk.VBox):
         self.titlebar.update_terminal_size(column_count, row_count)
 
         if self.terminator.tmux_control:
-            # self.terminator.tmux_control.resize_pane(self.pane_id, row_count, column_count)
             # FIXME: probably not the best place for this, update tmux client size to match the window geometry
             window = self.terminator.get_windows()[0]
             column_count, row_count = map(int, get_column_row_count(window))
@@ -1379,6 +1461,10 @@ class Terminal(Gtk.VBox):
             dbg('still laying out, refusing to spawn a child')
             return
 
+        if self.spawn_pending():
+            dbg('shell of %s is already being started', self.uuid.urn)
+            return
+
         if respawn == False:
             self.vte.grab_focus()
 
@@ -1426,12 +1512,13 @@ class Terminal(Gtk.VBox):
             self.vte.feed(_('Unable to find a shell'))
             return(-1)
 
+        envv = []
+        # Shells are started asynchronously, so this can't go in our
+        # own environment
         try:
-            os.putenv('WINDOWID', '%s' % self.vte.get_parent_window().xid)
+            envv.append('WINDOWID=%s' % self.vte.get_parent_window().xid)
         except AttributeError:
             pass
-
-        envv = []
         envv.append('TERM=%s' % self.config['term'])
         envv.append('COLORTERM=%s' % self.config['colorterm'])
         envv.append('PWD=%s' % self.cwd)
@@ -1455,21 +1542,86 @@ class Terminal(Gtk.VBox):
                                          pane_id=active_pane_id)
         else:
             args.insert(0, shell)
-            result,  self.pid = self.vte.spawn_sync(Vte.PtyFlags.DEFAULT,
-                                           self.cwd,
-                                           args,
-                                           envv,
-                                           GLib.SpawnFlags.FILE_AND_ARGV_ZERO | GLib.SpawnFlags.DO_NOT_REAP_CHILD,
-                                           None,
-                                           None,
-                                           None)
+            self.spawn_args = (args, envv)
+            self.spawn_queued = time.time()
+            self.terminator.queue_spawn(self)
         self.command = shell
 
         self.titlebar.update()
 
-        if self.pid == -1:
-            self.vte.feed(_('Unable to start shell:') + shell)
-            return(-1)
+    def do_spawn(self):
+        """Start the shell queued by spawn_child, on_child_spawned is called
+        once it is running"""
+        args, envv = self.spawn_args
+        self.spawn_args = None
+        flags = GLib.SpawnFlags.FILE_AND_ARGV_ZERO | \
+                GLib.SpawnFlags.DO_NOT_REAP_CHILD
+
+        if not hasattr(self.vte, 'spawn_async'):
+            # VTE before 0.48 can only spawn synchronously
+            error = None
+            try:
+                result, pid = self.vte.spawn_sync(Vte.PtyFlags.DEFAULT,
+                                                  self.cwd, args, envv, flags,
+                                                  None, None, None)
+            except GLib.GError, ex:
+                pid, error = -1, ex
+            self.on_child_spawned(self.vte, pid, error)
+            return
+
+        self.vte.spawn_async(Vte.PtyFlags.DEFAULT, self.cwd, args, envv,
+                             flags, None, None, -1, None,
+                             self.on_child_spawned, None)
+
+    def on_child_spawned(self, _vte, pid, error, *_user_data):
+        """Our shell has been started, or failed to"""
+        self.terminator.spawn_finished(self)
+        now = time.time()
+        latency = now - self.spawn_queued
+        startupprofile.record('shell of %s' % self.uuid.urn, self.spawn_queued,
+                              now)
+        self.spawn_queued = None
+
+        if not self.vte:
+            # We were closed while it was starting
+            if pid > 0:
+                os.kill(pid, signal.SIGHUP)
+            return
+
+        if error or pid == -1:
+            err('Unable to start %s: %s' % (self.command, error))
+            self.pid = -1
+            self.vte.feed(_('Unable to start shell:') + self.command)
+            return
+
+        self.pid = pid
+        self.spawn_latency = latency
+        dbg('started %s as pid %d in %.1fms' % (self.command, pid,
+                                                latency * 1000))
+
+    def spawn_pending(self):
+        """Is our shell queued, being started or deferred"""
+        return(self.spawn_args is not None or self.spawn_queued is not None
+               or self.spawn_deferred)
+
+    def defer_spawn(self):
+        """Leave our shell unstarted until we are first shown, or get
+        some input"""
+        dbg('deferring the shell of %s' % self.uuid.urn)
+        self.spawn_deferred = True
+        self.vte.feed(_('The shell starts when this tab is opened'))
+        self.cnxids.new(self.vte, 'map', self.start_deferred_spawn)
+
+    def start_deferred_spawn(self, _widget=None):
+        """Start the shell put off by defer_spawn"""
+        if not self.spawn_deferred:
+            return
+        self.spawn_deferred = False
+        self.cnxids.remove_signal(self.vte, 'map')
+        self.vte.reset(True, True)
+        # Like a respawn, this mustn't take the focus from the terminal
+        # that has it
+        self.spawn_child(respawn=True)
 
     def prepare_url(self, urlmatch):
         """Prepare a URL from a VTE match"""
@@ -1547,6 +1699,8 @@ class Terminal(Gtk.VBox):
 
     def feed(self, text):
         """Feed the supplied text to VTE"""
+        if self.spawn_deferred:
+            self.start_deferred_spawn()
         self.vte.feed_child(text, len(text))
 
     def zoom_in(self):
@@ -1573,12 +1727,9 @@ class Terminal(Gtk.VBox):
 
     def zoom_orig(self):
         """Restore original font size"""
-        if self.config['use_system_font'] == True:
-            font = self.config.get_system_mono_font()
-        else:
-            font = self.config['font']
-        dbg("Terminal::zoom_orig: restoring font to: %s" % font)
-        self.set_font(Pango.FontDescription(font))
+        font = get_render_settings(self.config).font
+        dbg("Terminal::zoom_orig: restoring font to: %s", font)
+        self.set_font(font)
         self.custom_font_size = None
 
     def set_font(self, fontdesc):
@@ -1640,6 +1791,17 @@ class Terminal(Gtk.VBox):
         widget.get_window().process_updates(True)
         return False
 
+    def set_tmux_offscreen(self, offscreen):
+        """Stop feeding tmux output to us while we can't be seen, and catch
+        up on what we missed once we can"""
+        if offscreen:
+            self.tmux_offscreen = True
+            return
+        self.tmux_offscreen = False
+        if self.tmux_missed_output and not self.tmux_catching_up:
+            self.tmux_catching_up = True
+            self.control.catch_up_output(self.pane_id)
+
     def describe_layout(self, count, parent, global_layout, child_order):
         """Describe our layout"""
         layout = {}
@@ -1679,11 +1841,14 @@ class Terminal(Gtk.VBox):
             self.directory = layout['directory']
         if layout.has_key('uuid') and layout['uuid'] != '':
             self.uuid = make_uuid(layout['uuid'])
-        if layout.has_key('tmux'):
-            tmux = layout['tmux']
-            self.pane_id = tmux['pane_id']
+        if layout.has_key('pane_id'):
+            self.pane_id = layout['pane_id']
             self.terminator.pane_id_to_terminal[self.pane_id] = self
-            self.control.initial_output(self.pane_id)
+            if self.tmux_virtual_scrollback():
+                self.control.initial_output(self.pane_id,
+                                            self.config['scrollback_lines'])
+            else:
+                self.control.initial_output(self.pane_id)
 
     def scroll_by_page(self, pages):
         """Scroll up or down in pages"""
@@ -1947,6 +2112,7 @@ class Terminal(Gtk.VBox):
         self.titlebar.label.edit()
 
     def key_layout_launcher(self):
+        from layoutlauncher import LayoutLauncher
         LAYOUTLAUNCHER=LayoutLauncher()
 
     def key_page_up(self):
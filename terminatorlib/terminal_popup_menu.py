@@ -10,11 +10,9 @@ from gi.repository import Gtk
 
 from version import APP_NAME
 from translation import _
-from encoding import TerminatorEncoding
 from terminator import Terminator
 from util import err, dbg
 from config import Config
-from prefseditor import PrefsEditor
 import plugin
 
 class TerminalPopupMenu(object):
@@ -188,7 +186,7 @@ class TerminalPopupMenu(object):
 
         if hasattr(Gtk, 'Builder'):  # VERIFY FOR GTK3: is this ever false?
             item = Gtk.MenuItem.new_with_mnemonic(_('_Preferences'))
-            item.connect('activate', lambda x: PrefsEditor(self.terminal))
+            item.connect('activate', self.on_preferences)
             menu.append(item)
 
         profilelist = sorted(self.config.list_profiles(), key=string.lower)
@@ -237,8 +235,15 @@ class TerminalPopupMenu(object):
         return(True)
 
 
+    def on_preferences(self, _widget):
+        """Open the preferences. The editor is big, so it is only imported
+        the first time it's needed"""
+        from prefseditor import PrefsEditor
+        PrefsEditor(self.terminal)
+
     def add_encoding_items(self, menu):
         """Add the encoding list to the menu"""
+        from encoding import TerminatorEncoding
         terminal = self.terminal
         active_encodings = terminal.config['active_encodings']
         item = Gtk.MenuItem.new_with_mnemonic(_("Encodings"))
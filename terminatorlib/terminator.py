@@ -3,23 +3,24 @@
 # GPL v2 only
 """terminator.py - class for the master Terminator singleton"""
 
+import collections
 import copy
 import os
 import gi
 gi.require_version('Vte', '2.91')
-from gi.repository import Gtk, Gdk, Vte, GdkX11
+from gi.repository import GObject, Gtk, Gdk, Vte
 from gi.repository.GLib import GError
 
 import borg
 from borg import Borg
 from config import Config
 from keybindings import Keybindings
-from util import dbg, err, enumerate_descendants
+from util import dbg, err, enumerate_descendants, wind_layout, \
+        ibus_daemon_running
 from factory import Factory
+from startupprofile import timed
 from cwd import get_pid_cwd
 from version import APP_NAME, APP_VERSION
-import tmux.control
-import tmux.notifications
 
 def eventkey2gdkevent(eventkey):  # FIXME FOR GTK3: is there a simpler way of casting from specific EventKey to generic (union) GdkEvent?
     gdkevent = Gdk.Event.new(eventkey.type)
@@ -69,7 +70,18 @@ class Terminator(Borg):
 
     tmux_control = None
     pane_id_to_terminal = None
+    pane_id_to_placeholder = None
     initial_layout = None
+    tmux_layout_syncs = None
+
+    spawn_queue = None
+    spawns_running = None
+
+    applied_config = None
+    # config items the style providers are made from
+    STYLE_KEYS = ('use_theme_colors', 'background_color', 'background_type',
+                  'background_darkness', 'extra_styling', 'handle_size')
+    NOTEBOOK_KEYS = ('scroll_tabbar', 'tab_position', 'hide_tabbar')
 
     def __init__(self):
         """Class initialiser"""
@@ -105,6 +117,14 @@ class Terminator(Borg):
             self.attempt_gnome_client()
         if self.pane_id_to_terminal is None:
             self.pane_id_to_terminal = {}
+        if self.pane_id_to_placeholder is None:
+            self.pane_id_to_placeholder = {}
+        if self.tmux_layout_syncs is None:
+            self.tmux_layout_syncs = {}
+        if self.spawn_queue is None:
+            self.spawn_queue = collections.deque()
+        if self.spawns_running is None:
+            self.spawns_running = 0
 
         self.connect_signals()
 
@@ -123,6 +143,9 @@ class Terminator(Borg):
 
     def start_tmux(self, remote=None):
         """Store the command line argument intended for tmux and start the process"""
+        # Only loaded for --tmux
+        import tmux.control
+        import tmux.notifications
         if self.tmux_control is None:
             handler = tmux.notifications.NotificationsHandler(self)
             self.tmux_control = tmux.control.TmuxControl(
@@ -207,6 +230,12 @@ class Terminator(Borg):
             dbg('no windows remain, quitting')
             Gtk.main_quit()
 
+    def is_ibus_running(self):
+        """Whether IBus is running, found out the first time it's asked"""
+        if self.ibus_running is None:
+            self.ibus_running = ibus_daemon_running()
+        return(self.ibus_running)
+
     def register_terminal(self, terminal):
         """Register a new terminal widget"""
         if terminal not in self.terminals:
@@ -228,34 +257,56 @@ class Terminator(Borg):
             dbg('Terminator::deregister_terminal: %d terminals remain' %
                     len(self.terminals))
 
+    def queue_spawn(self, terminal):
+        """Queue the start of a terminal's shell. No more than
+        spawn_concurrency shells are being started at any time"""
+        self.spawn_queue.append(terminal)
+        self.run_spawn_queue()
+
+    def run_spawn_queue(self):
+        """Start queued shells while there is room for them"""
+        limit = max(self.config['spawn_concurrency'], 1)
+        while self.spawn_queue and self.spawns_running < limit:
+            terminal = self.spawn_queue.popleft()
+            if terminal not in self.terminals:
+                dbg('terminal closed before its shell was started')
+                continue
+            self.spawns_running += 1
+            terminal.do_spawn()
+
+    def spawn_finished(self, terminal):
+        """A shell has been started, or failed to"""
+        self.spawns_running -= 1
+        self.run_spawn_queue()
+
     def find_terminal_by_uuid(self, uuid):
         """Search our terminals for one matching the supplied UUID"""
-        dbg('searching self.terminals for: %s' % uuid)
+        dbg('searching self.terminals for: %s', uuid)
         for terminal in self.terminals:
-            dbg('checking: %s (%s)' % (terminal.uuid.urn, terminal))
+            dbg('checking: %s (%s)', terminal.uuid.urn, terminal)
             if terminal.uuid.urn == uuid:
                 return terminal
         return None
 
     def find_window_by_uuid(self, uuid):
         """Search our terminals for one matching the supplied UUID"""
-        dbg('searching self.terminals for: %s' % uuid)
+        dbg('searching self.terminals for: %s', uuid)
         for window in self.windows:
-            dbg('checking: %s (%s)' % (window.uuid.urn, window))
+            dbg('checking: %s (%s)', window.uuid.urn, window)
             if window.uuid.urn == uuid:
                 return window
         return None
 
     def find_terminal_by_pane_id(self, pane_id):
         """Search our terminals for one matching the supplied pane_id"""
-        dbg('searching self.terminals for: %s' % pane_id)
+        dbg('searching self.terminals for: %s', pane_id)
         for terminal in self.terminals:
-            dbg('checking: %s (%s)' % (terminal.pane_id, terminal))
+            dbg('checking: %s (%s)', terminal.pane_id, terminal)
             if terminal.pane_id == pane_id:
                 return terminal
         return None
 
-    def new_window(self, cwd=None, profile=None):
+    def new_window(self, cwd=None, profile=None, show=True):
         """Create a window with a Terminal in it"""
         maker = Factory()
         window = maker.make('Window')
@@ -265,22 +316,23 @@ class Terminator(Borg):
         if profile and self.config['always_split_with_profile']:
             terminal.force_set_profile(None, profile)
         window.add(terminal)
-        window.show(True)
+        if show:
+            window.show(True)
         terminal.spawn_child()
 
         return(window, terminal)
 
+    @timed('Terminator.create_layout')
     def create_layout(self, layoutname):
         """Create all the parts necessary to satisfy the specified layout"""
-        layout = copy.deepcopy(self.initial_layout)
-        objects = {}
+        layout = self.initial_layout
 
         self.doing_layout = True
         self.last_active_window = None
         self.prelayout_windows = self.windows[:]
 
         if not layout:
-            layout = copy.deepcopy(self.config.layout_get_config(layoutname))
+            layout = self.config.layout_get_config(layoutname)
             if not layout:
                 # User specified a non-existent layout. default to one Terminal
                 err('layout %s not defined' % layout)
@@ -288,56 +340,18 @@ class Terminator(Borg):
                 return
 
         # Wind the flat objects into a hierarchy
-        hierarchy = {}
-        count = 0
-        # Loop over the layout until we have consumed it, or hit 1000 loops.
-        # This is a stupid artificial limit, but it's safe.
-        while len(layout) > 0 and count < 1000:
-            count = count + 1
-            if count == 1000:
-                err('hit maximum loop boundary. THIS IS VERY LIKELY A BUG')
-            for obj in layout.keys():
-                if layout[obj]['type'].lower() == 'window':
-                    hierarchy[obj] = {}
-                    hierarchy[obj]['type'] = 'Window'
-                    hierarchy[obj]['children'] = {}
-
-                    # Copy any additional keys
-                    for objkey in layout[obj].keys():
-                        if layout[obj][objkey] != '' and not hierarchy[obj].has_key(objkey):
-                            hierarchy[obj][objkey] = layout[obj][objkey]
-
-                    objects[obj] = hierarchy[obj]
-                    del(layout[obj])
-                else:
-                    # Now examine children to see if their parents exist yet
-                    if not layout[obj].has_key('parent'):
-                        err('Invalid object: %s' % obj)
-                        del(layout[obj])
-                        continue
-                    if objects.has_key(layout[obj]['parent']):
-                        # Our parent has been created, add ourselves
-                        childobj = {}
-                        childobj['type'] = layout[obj]['type']
-                        childobj['children'] = {}
-
-                        # Copy over any additional object keys
-                        for objkey in layout[obj].keys():
-                            if not childobj.has_key(objkey):
-                                childobj[objkey] = layout[obj][objkey]
-
-                        objects[layout[obj]['parent']]['children'][obj] = childobj
-                        objects[obj] = childobj
-                        del(layout[obj])
-
-        layout = hierarchy
+        layout = wind_layout(layout)
 
+        # The windows are built hidden, so that GTK doesn't allocate and
+        # draw every intermediate split, and are shown once complete
+        windows = []
         for windef in layout:
             if layout[windef]['type'] != 'Window':
                 err('invalid layout format. %s' % layout)
                 raise(ValueError)
             dbg('Creating a window')
-            window, terminal = self.new_window()
+            window, terminal = self.new_window(show=False)
+            windows.append(window)
             if layout[windef].has_key('position'):
                 parts = layout[windef]['position'].split(':')
                 if len(parts) == 2:
@@ -364,8 +378,12 @@ class Terminator(Borg):
                 window.set_fullscreen(window.isfullscreen)
             window.create_layout(layout[windef])
 
+        for window in windows:
+            window.show_layout()
+
         self.layoutname = layoutname
 
+    @timed('Terminator.layout_done')
     def layout_done(self):
         """Layout operations have finished, record that fact"""
         self.doing_layout = False
@@ -379,9 +397,22 @@ class Terminator(Borg):
                 source = window
             window_last_active_term_mapping[window] = copy.copy(source.last_active_term)
 
-        for terminal in self.terminals:
-            if not terminal.pid:
-                terminal.spawn_child()
+        if self.tmux_control and not self.initial_layout:
+            self.spawn_tmux_children()
+        else:
+            # Terminals in background tabs may wait until they are shown
+            lazy = self.config['lazy_tab_shells']
+            visible = {}
+            if lazy:
+                for window in self.windows:
+                    visible.update(window.get_visible_terminals())
+            for terminal in self.terminals:
+                if terminal.pid or terminal.spawn_pending():
+                    continue
+                if lazy and terminal not in visible:
+                    terminal.defer_spawn()
+                else:
+                    terminal.spawn_child()
 
         for window in self.windows:
             if window.is_child_notebook():
@@ -418,50 +449,158 @@ class Terminator(Borg):
                     term = self.find_terminal_by_uuid(window_last_active_term_mapping[window].urn)
                     term.ensure_visible_and_focussed()
 
-        # Build list of new windows using prelayout list
-        new_win_list = []
-        for window in self.windows:
-            if window not in self.prelayout_windows:
-                new_win_list.append(window)
-        
-        # Make sure all new windows get bumped to the top
-        for window in new_win_list:
-            window.show()
-            window.grab_focus()
-            try:
-                t = GdkX11.x11_get_server_time(window.get_window())
-            except (TypeError, AttributeError):
-                t = 0
-            window.get_window().focus(t)
-
-        # Awful workaround to be sure that the last focused window is actually the one focused.
-        # Don't ask, don't tell policy on this. Even this is not 100%
+        # Give the focus to the window that last had it, or else to the last
+        # new window. It is requested once the window is mapped, instead of
+        # spinning the main loop until it is.
+        window = None
         if self.last_active_window:
             window = self.find_window_by_uuid(self.last_active_window.urn)
-            count = 0
-            while count < 1000 and Gtk.events_pending():
-                count += 1
-                Gtk.main_iteration_do(False)
-                window.show()
-                window.grab_focus()
-                try:
-                    t = GdkX11.x11_get_server_time(window.get_window())
-                except (TypeError, AttributeError):
-                    t = 0
-                window.get_window().focus(t)
+        if not window:
+            new_windows = [win for win in self.windows
+                           if win not in self.prelayout_windows]
+            if new_windows:
+                window = new_windows[-1]
+        if window:
+            window.request_focus()
 
         self.prelayout_windows = None
 
+    def spawn_tmux_children(self):
+        """Create the tmux panes of a new layout. Each tab becomes a tmux
+        window whose panes are all created in one go, its layout is then
+        set with a single select-layout once tmux told us the pane ids"""
+        maker = Factory()
+        for window in self.windows:
+            child = window.get_child()
+            if maker.isinstance(child, 'Notebook'):
+                tabs = [child.get_nth_page(page)
+                        for page in xrange(0, child.get_n_pages())]
+            else:
+                tabs = [child]
+            for tab in tabs:
+                if maker.isinstance(tab, 'Terminal'):
+                    terminals = [tab]
+                else:
+                    terminals = enumerate_descendants(tab)[1]
+                terminals = [term for term in terminals if not term.pid]
+                if not terminals:
+                    continue
+                # the first one creates the tmux window, the others split it
+                terminals[0].spawn_child()
+                for terminal in terminals[1:]:
+                    terminal.spawn_child(orientation='horizontal')
+                if len(terminals) > 1:
+                    self.tmux_control.run_when_done(
+                        lambda tab=tab: GObject.idle_add(
+                            self.apply_tmux_layout, tab))
+
+    def apply_tmux_layout(self, tab):
+        """Make the tmux window of a tab match its Terminator layout"""
+        layout = {}
+        tab.describe_layout(0, '', layout, 0)
+        root_name = pane_id = None
+        for name, item in layout.items():
+            if item['parent'] == '':
+                root_name = name
+            if item['type'] == 'Terminal':
+                terminal = self.find_terminal_by_uuid(item['uuid'].urn)
+                # pane ids are only known once tmux created the pane
+                if not terminal or not terminal.pane_id.startswith('%'):
+                    dbg('missing tmux pane, not applying layout')
+                    return False
+                item['pane_id'] = pane_id = terminal.pane_id
+        import tmux.layout
+        width = self.tmux_control.width or 80
+        height = self.tmux_control.height or 24
+        tmux_layout = tmux.layout.convert_to_tmux_layout(layout, root_name,
+                                                         width, height)
+        dbg('applying tmux layout: %s' % tmux_layout)
+        self.tmux_control.select_layout(pane_id, tmux_layout)
+        return False
+
+    def queue_tmux_layout_sync(self, widget):
+        """Push the layout of the tab holding widget to tmux once the user
+        stops resizing it, as a single select-layout"""
+        if not self.tmux_control or self.tmux_control.is_zoomed:
+            # when zoomed the tmux layout must not change
+            return
+        maker = Factory()
+        tab = widget
+        while maker.isinstance(tab.get_parent(), 'Paned'):
+            tab = tab.get_parent()
+        if tab in self.tmux_layout_syncs:
+            GObject.source_remove(self.tmux_layout_syncs[tab])
+        self.tmux_layout_syncs[tab] = GObject.timeout_add(
+            200, self.do_tmux_layout_sync, tab)
+
+    def do_tmux_layout_sync(self, tab):
+        """Handle a queued tmux layout synchronisation"""
+        del(self.tmux_layout_syncs[tab])
+        if not tab.get_parent():
+            dbg('tab went away, not syncing its layout')
+            return False
+        return self.apply_tmux_layout(tab)
+
     def on_gtk_theme_name_notify(self, settings, prop):
         """Reconfigure if the gtk theme name changes"""
         new_gtk_theme_name = settings.get_property(prop.name)
         if new_gtk_theme_name != self.cur_gtk_theme_name:
             self.cur_gtk_theme_name = new_gtk_theme_name
-            self.reconfigure()
+            self.reconfigure(['use_theme_colors'], restyle=True)
+
+    @timed('Terminator.reconfigure')
+    def reconfigure(self, outside_changes=(), restyle=False):
+        """Update configuration for the whole application. Only the items
+        that changed since the last time are applied, and only to terminals
+        whose profile they changed in. outside_changes are switches, such as
+        use_theme_colors, whose effect changed outside the config, for the
+        profiles that have them on. restyle rebuilds the style providers"""
+        base = self.config.base
+        base.invalidate_snapshots()
+
+        if self.applied_config is None or \
+           set(self.applied_config) != set(base.profiles):
+            changes = dict.fromkeys(base.profiles)
+        else:
+            changes = base.changed_keys(self.applied_config)
+            for profile in changes:
+                snapshot = base.get_snapshot(profile)
+                changes[profile].update([key for key in outside_changes
+                                         if snapshot.get(key)])
+        self.applied_config = base.copy_snapshots()
+        dbg('Terminator::reconfigure: changes: %s', changes)
+
+        def changed(*keys):
+            """Did any of keys change in any profile"""
+            for keys_changed in changes.values():
+                if keys_changed is None or not keys_changed.isdisjoint(keys):
+                    return(True)
+            return(False)
+
+        if restyle or changed(*self.STYLE_KEYS):
+            self.update_style_providers()
+
+        # Cause the terminals whose profile changed to reconfigure
+        for terminal in self.terminals:
+            profile = terminal.get_profile()
+            terminal_changes = changes.get(profile, changes.get('default'))
+            if terminal_changes is None or terminal_changes:
+                terminal.reconfigure(changed=terminal_changes)
 
-    def reconfigure(self):
-        """Update configuration for the whole application"""
+        # Reparse our keybindings
+        if changed('keybindings'):
+            self.keybindings.configure(self.config['keybindings'])
+
+        # Update tab position if appropriate
+        if changed(*self.NOTEBOOK_KEYS):
+            maker = Factory()
+            for window in self.windows:
+                child = window.get_child()
+                if maker.isinstance(child, 'Notebook'):
+                    child.configure()
 
+    def update_style_providers(self):
+        """Build the CSS for our widgets and each profile, then apply it"""
         if self.style_providers != []:
             for style_provider in self.style_providers:
                 Gtk.StyleContext.remove_provider_for_screen(
@@ -584,20 +723,6 @@ class Terminator(Borg):
                 self.style_providers[idx],
                 Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION+idx)
 
-        # Cause all the terminals to reconfigure
-        for terminal in self.terminals:
-            terminal.reconfigure()
-
-        # Reparse our keybindings
-        self.keybindings.configure(self.config['keybindings'])
-
-        # Update tab position if appropriate
-        maker = Factory()
-        for window in self.windows:
-            child = window.get_child()
-            if maker.isinstance(child, 'Notebook'):
-                child.configure()
-
     def on_css_parsing_error(self, provider, section, error, user_data=None):
         """Report CSS parsing issues"""
         file_path = section.get_file().get_path()
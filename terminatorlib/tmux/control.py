@@ -5,8 +5,9 @@ import Queue
 from pipes import quote
 from gi.repository import Gtk, Gdk
 
+from terminatorlib.tmux import history
 from terminatorlib.tmux import notifications
-from terminatorlib.util import dbg
+from terminatorlib.util import dbg, err
 
 ESCAPE_CODE = '\033'
 
@@ -40,6 +41,10 @@ MOUSE_WHEEL = {
     Gdk.ScrollDirection.DOWN: "C-e C-e C-e",
 }
 
+# lines of history to fetch, on top of the visible screen, for a pane whose
+# output was dropped while it was hidden
+CATCH_UP_HISTORY_LINES = 1000
+
 # TODO: implement ssh connection using paramiko
 class TmuxControl(object):
 
@@ -100,8 +105,10 @@ class TmuxControl(object):
     def split_window(self, cwd, orientation, pane_id,
                      command=None, marker=''):
         orientation = '-h' if orientation == 'horizontal' else '-v'
-        tmux_command = 'split-window {} -t {} -P -F "#D {}"'.format(
-            orientation, pane_id, marker)
+        tmux_command = 'split-window {}'.format(orientation)
+        if pane_id:
+            tmux_command += ' -t {}'.format(pane_id)
+        tmux_command += ' -P -F "#D {}"'.format(marker)
         if cwd:
             tmux_command += ' -c "{}"'.format(cwd)
         if command:
@@ -109,6 +116,12 @@ class TmuxControl(object):
 
         self._run_command(tmux_command,
                           callback=self.notifications_handler.pane_id_result)
+        if not pane_id:
+            # batch of splits in the current window (see Terminator
+            # .spawn_tmux_children), spread the panes evenly so that the
+            # next split still has room for a new pane; the real layout
+            # is applied once all the panes are there
+            self._run_command('select-layout tiled')
 
     def new_window(self, cwd=None, command=None, marker=''):
         tmux_command = 'new-window -P -F "#D {}"'.format(marker)
@@ -172,15 +185,74 @@ class TmuxControl(object):
 
     def initial_layout(self):
         self._run_command(
-            'list-windows -t {} -F "#{{window_layout}}"'
+            'list-windows -t {} -F "#{{window_id}} #{{window_layout}}"'
             .format(self.session_name),
             callback=self.notifications_handler.initial_layout_result)
 
-    def initial_output(self, pane_id):
+    def initial_output(self, pane_id, history_lines=None):
+        if history_lines is None:
+            start = '-'
+        else:
+            start = -history_lines
+        handler = self.notifications_handler
+        captured = {}
+        self._run_commands([
+            ('capture-pane -J -p -t {} -eC -S {} -E -'.format(pane_id, start),
+             handler.capture_result_callback(captured)),
+            ('display -p -t {} "#{{cursor_y}},#{{cursor_x}}"'.format(pane_id),
+             handler.initial_output_result_callback(pane_id, captured))])
+
+    def capture_history(self, pane_id, callback):
+        """Call callback with the lines of the whole history and screen of
+        a pane, wrapped lines joined"""
         self._run_command(
-            'capture-pane -J -p -t {} -eC -S - -E -'.format(pane_id),
-            callback=self.notifications_handler.initial_output_result_callback(
-                pane_id))
+            'capture-pane -J -p -t {} -S - -E -'.format(pane_id),
+            callback=callback)
+
+    def load_history(self, pane_id, pages, cache, distance, offset):
+        """Fetch the history pages of a pane which aren't cached yet, then
+        the offset rows above its screen and the screen itself, and have the
+        notifications handler refill the terminal with them"""
+        handler = self.notifications_handler
+        fetched = {}
+        commands = []
+        for page in xrange(pages):
+            if cache.get(page) is not None:
+                continue
+            start, end = history.page_range(page, offset)
+            commands.append((
+                'capture-pane -p -t {} -eC -S {} -E {}'.format(
+                    pane_id, start, end),
+                handler.history_page_result_callback(pane_id, page, fetched)))
+        commands.append((
+            'capture-pane -p -t {} -eC -S {}'.format(pane_id, -offset),
+            handler.history_page_result_callback(pane_id, 'screen', fetched)))
+        commands.append((
+            'display -p -t {} "#{{cursor_x}} #{{cursor_y}} '
+            '#{{history_size}}"'.format(pane_id),
+            handler.history_result_callback(
+                pane_id, pages, fetched, distance, offset)))
+        self._run_commands(
+            commands, errback=handler.history_error_callback(pane_id, pages))
+
+    def catch_up_output(self, pane_id):
+        handler = self.notifications_handler
+        captured = {}
+        self._run_commands([
+            ('capture-pane -J -p -t {} -eC -S -{}'.format(
+                pane_id, CATCH_UP_HISTORY_LINES),
+             handler.capture_result_callback(captured)),
+            ('display -p -t {} "#{{cursor_y}},#{{cursor_x}}"'.format(pane_id),
+             handler.catch_up_output_result_callback(pane_id, captured))],
+            errback=handler.catch_up_output_error_callback(pane_id))
+
+    def select_layout(self, pane_id, layout):
+        self._run_command('select-layout -t {} "{}"'.format(pane_id, layout))
+
+    def run_when_done(self, callback):
+        """Call callback (in the notifications thread) once the results of
+        all the commands sent so far have been handled"""
+        self._run_command('display -p ""', callback=lambda result: callback())
 
     def toggle_zoom(self, pane_id, zoom=False):
         self.is_zoomed = not self.is_zoomed
@@ -252,6 +324,24 @@ class TmuxControl(object):
             callback = callback or notifications.noop
             self.requests.put(callback)
 
+    def _run_commands(self, commands, errback=None):
+        """Run a list of (command, callback) as a single tmux command
+        sequence, so no output of the panes comes in between them. tmux
+        still replies to each command separately, but stops at the first
+        one failing; errback is called then"""
+        if not self.input:
+            dbg('No tmux connection. [commands={}]'.format(commands))
+            return
+        try:
+            self.input.write('{}\n'.format(
+                ' ; '.join(command for command, _callback in commands)))
+        except IOError:
+            dbg("Tmux server has gone away.")
+            return
+        sequence = notifications.CommandSequence(errback)
+        for _command, callback in commands:
+            self.requests.put(sequence.callback(callback or notifications.noop))
+
     @staticmethod
     def kill_server():
         command = ['tmux', 'kill-session', '-t', 'terminator']
@@ -284,7 +374,11 @@ class TmuxControl(object):
                 dbg("Discarding invalid output from the control terminal.")
                 continue
             notification.consume(line, self.output)
-            handler.handle(notification)
+            try:
+                handler.handle(notification)
+            except Exception, ex:
+                # a bad result mustn't stop us handling the next ones
+                err('Unable to handle {}: {}'.format(notification, ex))
         handler.terminate()
 
     def display_pane_tty(self, pane_id):
@@ -293,13 +387,3 @@ class TmuxControl(object):
 
         self._run_command(tmux_command,
                 callback=self.notifications_handler.pane_tty_result)
-
-    def resize_pane(self, pane_id, rows, cols):
-        if self.is_zoomed:
-            # if the pane is zoomed, there is no need for tmux to
-            # change the current layout
-            return
-        tmux_command = 'resize-pane -t "{}" -x {} -y {}'.format(
-            pane_id, cols, rows)
-
-        self._run_command(tmux_command)
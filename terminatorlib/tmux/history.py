@@ -0,0 +1,57 @@
+import collections
+
+# number of history rows fetched from tmux at a time
+PAGE_LINES = 500
+
+
+def page_range(page, offset=0):
+    """Return the capture-pane start and end lines of a history page.
+
+    Pages are counted back from offset rows above the visible screen, the
+    rows the terminal holds anyway: page 0 holds the PAGE_LINES rows right
+    above those. Wrapped lines aren't joined, so a page is PAGE_LINES rows
+    unless it reaches the start of the history.
+    """
+    return (-offset - (page + 1) * PAGE_LINES,
+            -offset - page * PAGE_LINES - 1)
+
+
+class HistoryCache(object):
+    """Bounded LRU cache of the history pages of a single tmux pane.
+
+    As pages are numbered from the visible screen, they move as soon as the
+    pane prints anything; the cache has to be cleared when it does.
+    """
+
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.pages = collections.OrderedDict()
+
+    def get(self, page):
+        """Return the lines of a page, or None if it isn't cached"""
+        lines = self.pages.pop(page, None)
+        if lines is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # reinsert as the most recently used page
+        self.pages[page] = lines
+        return lines
+
+    def put(self, page, lines):
+        self.pages.pop(page, None)
+        if len(self.pages) >= self.maxsize:
+            self.pages.popitem(last=False)
+        self.pages[page] = lines
+
+    def clear(self):
+        self.pages.clear()
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __str__(self):
+        return 'HistoryCache[size={}/{}, hits={}, misses={}]'.format(
+            len(self.pages), self.maxsize, self.hits, self.misses)
@@ -1,7 +1,25 @@
-from pyparsing import *
+import collections
+import re
+import string
 
-class LayoutParser():
-    """BNF representation for a Tmux Layout
+# a single element of a layout, i.e. "<size>,<x>,<y>" followed either by
+# ",<pane_id>" for panes or by the start token for containers
+ELEMENT_RE = re.compile(r'(\d+)x(\d+),(\d+),(\d+)(?:,(\d+)|([{\[]))')
+
+CONTAINER_END_TOKENS = {'{': '}', '[': ']'}
+
+
+def layout_checksum(layout):
+    """Compute the tmux checksum of a layout body (what follows the comma)"""
+    checksum = 0
+    for char in layout:
+        checksum = (checksum >> 1) + ((checksum & 1) << 15)
+        checksum = (checksum + ord(char)) & 0xffff
+    return '{:04x}'.format(checksum)
+
+
+class LayoutParser(object):
+    """Single pass parser for a Tmux Layout, following this BNF
     <layout>        :: <layout_name> <comma> <element>+ ;
     <element>       :: ( <container> | <pane> ) <comma>? ;
     <layout_name>   :: <hexadecimal>{4} ;
@@ -16,84 +34,146 @@ class LayoutParser():
     <decimal-digit> :: "0" | ... | "9" ;
     <hex-digit>     :: <decimal-digit> | "a" | ... | "f" ;
     <comma>         :: "," ;
+
+    Nesting is tracked with an explicit stack, so the depth of the layout is
+    not bound by the interpreter recursion limit.
     """
-    layout_parser = None
 
-    def __init__(self):
-        decimal = Word(nums)
+    def parse(self, layout):
+        """Parse a layout string and return its root Container."""
+        layout_name, _, body = layout.partition(',')
+        if (len(layout_name) != 4 or
+                not all(char in string.hexdigits for char in layout_name)):
+            raise ValueError('Illegal layout name: {}'.format(layout))
+        if layout_name.lower() != layout_checksum(body):
+            raise ValueError('Layout checksum mismatch: {}'.format(layout))
+
+        root = None
+        # each entry is [start_token, width, height, x, y, children]
+        stack = []
+        position = 0
+        end = len(body)
+        while True:
+            match = ELEMENT_RE.match(body, position)
+            if match is None:
+                raise ValueError('Illegal window layout at offset {}: {}'
+                                 .format(position, layout))
+            width, height, x, y, pane_id, start_token = match.groups()
+            position = match.end()
+            if start_token:
+                stack.append([start_token, int(width), int(height), int(x),
+                              int(y), []])
+                continue
+            element = Pane(int(width), int(height), int(x), int(y),
+                           '%' + pane_id)
+            while True:
+                if stack:
+                    stack[-1][5].append(element)
+                elif root is None:
+                    root = element
+                else:
+                    raise ValueError('Multiple root elements in layout: {}'
+                                     .format(layout))
+                if position == end or body[position] == ',':
+                    break
+                if not stack or \
+                        body[position] != CONTAINER_END_TOKENS[stack[-1][0]]:
+                    raise ValueError('Illegal window layout at offset {}: {}'
+                                     .format(position, layout))
+                position += 1
+                start_token, width, height, x, y, children = stack.pop()
+                container_type = (Horizontal if start_token == '{'
+                                  else Vertical)
+                element = container_type(width, height, x, y, children)
+            if position == end:
+                break
+            # skip the comma separating sibling elements
+            position += 1
+
+        if stack:
+            raise ValueError('Unterminated container in layout: {}'
+                             .format(layout))
+        return root
+
+
+class LayoutCache(object):
+    """Bounded LRU cache of parsed (and converted) tmux layouts.
+
+    tmux keeps sending the very same layout strings (initial layout, every
+    %layout-change, zoom toggles), the cache makes sure each of them is only
+    parsed and converted once. Entries are keyed on the whole layout string,
+    i.e. on the checksum together with the layout it covers.
+
+    The returned trees and Terminator layouts are shared between callers
+    and must not be modified.
+    """
 
-        comma = Suppress(Literal(','))
-        start_token = Literal('{') | Literal('[')
-        end_token   = Suppress(Literal('}') | Literal(']'))
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.parser = LayoutParser()
+        self.entries = collections.OrderedDict()
+
+    def _lookup(self, layout):
+        entry = self.entries.pop(layout, None)
+        if entry is None:
+            self.misses += 1
+            # [parsed tree, converted Terminator layout]
+            entry = [self.parser.parse(layout), None]
+            if len(self.entries) >= self.maxsize:
+                self.entries.popitem(last=False)
+        else:
+            self.hits += 1
+        # (re)insert as the most recently used entry
+        self.entries[layout] = entry
+        return entry
 
-        layout_name = Suppress(Word(hexnums, min=4, max=4))
-        size        = decimal("width") + Suppress(Literal('x')) + decimal("height")
+    def parse(self, layout):
+        """Return the root Container of the layout"""
+        return self._lookup(layout)[0]
 
-        preamble    = size + comma + decimal("x") + comma + decimal("y")
-        pane        = Group(preamble + comma + decimal("pane_id"))
-        element     = Forward() # will be defined later
-        container   = Group(preamble + start_token + OneOrMore(element) + end_token)
+    def convert(self, layout):
+        """Return the Terminator layout of a single tmux window layout"""
+        entry = self._lookup(layout)
+        if entry[1] is None:
+            entry[1] = convert_to_terminator_layout([entry[0]])
+        return entry[1]
 
-        element << (container | pane) + Optional(comma)
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = 0
 
-        self.layout_parser = layout_name + comma + OneOrMore(element)
+    def __str__(self):
+        return 'LayoutCache[size={}/{}, hits={}, misses={}]'.format(
+            len(self.entries), self.maxsize, self.hits, self.misses)
 
-    def parse(self, layout):
-        parsed = self.layout_parser.parseString(layout)
-        return parsed.asList()
 
-def parse_layout(layout):
-    """Apply our application logic to the parsed layout.
+def get_pane_ids(container):
+    """Return the ids of all the panes found in a parsed layout, in order"""
+    pane_ids = []
+    stack = [container]
+    while stack:
+        container = stack.pop()
+        if isinstance(container, Pane):
+            pane_ids.append(container.pane_id)
+        else:
+            stack.extend(reversed(container.children))
+    return pane_ids
 
-    Arguments:
-    layout -- Layout parsed by LayoutParser.parse(),
-              it is represented as a nested list; each nested
-              list has the following format:
-              [0]  : width,
-              [1]  : height,
-              [2]  : position on x axis,
-              [3]  : position on y axis,
-              [4]  : '{' if the current element is a horizontal splits container,
-                     '[' if the current element is a vertical splits container,
-                     '%[0-9]+' if the current element is a pane
-              [5+] : if present, they are nested lists with the same structure
 
-    """
-    result = []
-
-    children = []
-    for item in layout[5:]:
-        children.extend(parse_layout(item))
-
-    if layout[4] == '{':
-        result.append(Horizontal(
-            layout[0],
-            layout[1],
-            layout[2],
-            layout[3],
-            children
-            ))
-
-    elif layout[4] == '[':
-        result.append(Vertical(
-            layout[0],
-            layout[1],
-            layout[2],
-            layout[3],
-            children
-            ))
-    else:
-        result.append(Pane(
-            layout[0],
-            layout[1],
-            layout[2],
-            layout[3],
-            "%{}".format(layout[4])
-            ))
+def convert_to_terminator_layout(window_layouts):
+    """Convert parsed tmux window layouts into a flat Terminator layout.
 
-    return result
+    tmux containers can hold any number of children, whereas Terminator
+    Paned widgets hold exactly two: a container with k children becomes a
+    chain of k - 1 Paned widgets, each of them holding one child and the
+    next Paned of the chain. Each Paned gets the ratio of its first child,
+    so that the Terminator panes match the tmux ones.
 
-def convert_to_terminator_layout(window_layouts):
+    The tree is walked with an explicit stack, hence deeply nested layouts
+    or containers with lots of children are fine.
+    """
     assert len(window_layouts) > 0
     result = {}
     pane_index = 0
@@ -111,13 +191,126 @@ def convert_to_terminator_layout(window_layouts):
         }
         parent_name = notebook_name
     order = 0
-    for window_layout in window_layouts:
-        converter = _get_converter(window_layout)
-        pane_index, order = converter(
-            result, parent_name, window_layout, pane_index, order)
+    # each entry is (parent name, container, index of the first child still
+    # to be converted, space left along the split axis for those children)
+    stack = [(parent_name, window_layout, 0, None)
+             for window_layout in reversed(window_layouts)]
+    while stack:
+        parent_name, container, index, extent = stack.pop()
+        container_type = type(container)
+        if container_type is Pane:
+            result['terminal{}'.format(container.pane_id[1:])] = {
+                'type': 'Terminal',
+                'parent': parent_name,
+                'order': order,
+                'pane_id': container.pane_id
+            }
+            order += 1
+            continue
+        if container_type not in PANED_TYPES or not container.children:
+            raise ValueError('Illegal window layout: {}'.format(container))
+
+        terminator_type, size_attribute = PANED_TYPES[container_type]
+        children = container.children
+        if index == len(children) - 1:
+            # the last child takes the place of the rest of the chain
+            stack.append((parent_name, children[index], 0, None))
+            continue
+        if extent is None:
+            extent = getattr(container, size_attribute)
+        child = children[index]
+        size = getattr(child, size_attribute)
+        pane_name = 'pane{}'.format(pane_index)
+        pane_index += 1
+        # one cell of the remaining space is taken by the separator
+        result[pane_name] = {
+            'type': terminator_type,
+            'parent': parent_name,
+            'order': order,
+            'ratio': float(size) / max(extent - 1, 1)
+        }
+        order += 1
+        stack.append((pane_name, container, index + 1, extent - size - 1))
+        stack.append((pane_name, child, 0, None))
     return result
 
 
+def convert_to_tmux_layout(terminator_layout, root_name, width, height):
+    """Convert (part of) a flat Terminator layout into a tmux layout string.
+
+    Arguments:
+    terminator_layout -- flat Terminator layout, Terminal entries must
+                         have a 'pane_id', Paned ones may have a 'ratio'
+    root_name         -- name of the Terminal or Paned entry at the top of
+                         the tmux window
+    width, height     -- size of the tmux window
+
+    Chains of Paned widgets of the same type are merged into a single tmux
+    container, this is the reverse of convert_to_terminator_layout().
+    """
+    children = {}
+    for name, item in terminator_layout.items():
+        children.setdefault(item.get('parent'), []).append(
+            (item.get('order', 0), name))
+    for siblings in children.values():
+        siblings.sort()
+
+    root = Container(width, height, 0, 0)
+    root.children = []
+    # each entry is (name, x, y, width, height, parent container)
+    stack = [(root_name, 0, 0, width, height, root)]
+    while stack:
+        name, x, y, width, height, parent = stack.pop()
+        item = terminator_layout[name]
+        if item['type'] == 'Terminal':
+            parent.children.append(Pane(width, height, x, y,
+                                        item['pane_id']))
+            continue
+        if item['type'] not in TMUX_CONTAINER_TYPES:
+            raise ValueError('Illegal Terminator layout item: {}'
+                             .format(item))
+        container_type = TMUX_CONTAINER_TYPES[item['type']]
+        first, second = [child for _, child in children.get(name, [])]
+        if type(parent) is not container_type:
+            container = container_type(width, height, x, y, [])
+            parent.children.append(container)
+            parent = container
+        ratio = min(max(float(item.get('ratio', 0.5)), 0.0), 1.0)
+        # one cell is taken by the separator
+        if container_type is Horizontal:
+            size = min(max(int(round((width - 1) * ratio)), 1), width - 2)
+            stack.append((second, x + size + 1, y, width - size - 1, height,
+                          parent))
+            stack.append((first, x, y, size, height, parent))
+        else:
+            size = min(max(int(round((height - 1) * ratio)), 1), height - 2)
+            stack.append((second, x, y + size + 1, width, height - size - 1,
+                          parent))
+            stack.append((first, x, y, width, size, parent))
+
+    body = []
+    stack = list(root.children)
+    while stack:
+        container = stack.pop()
+        if not isinstance(container, Container):
+            # end token of a container
+            body.append(container)
+            continue
+        if body and body[-1] not in '{[':
+            body.append(',')
+        body.append('{}x{},{},{}'.format(container.width, container.height,
+                                         container.x, container.y))
+        if isinstance(container, Pane):
+            body.append(',' + container.pane_id.lstrip('%'))
+        else:
+            start_token = '{' if isinstance(container, Horizontal) else '['
+            body.append(start_token)
+            stack.append(CONTAINER_END_TOKENS[start_token])
+            stack.extend(reversed(container.children))
+    body = ''.join(body)
+    return '{},{}'.format(layout_checksum(body), body)
+
+
 class Container(object):
 
     def __init__(self, width, height, x, y):
@@ -169,92 +362,12 @@ class Horizontal(Container):
         return 'children={}'.format(self.children)
 
 
-def _covert_pane_to_terminal(result, parent_name, pane, pane_index, order):
-    assert isinstance(pane, Pane)
-    terminal = _convert(parent_name, 'Terminal', pane, order)
-    order += 1
-    terminal['tmux']['pane_id'] = pane.pane_id
-    result['terminal{}'.format(pane.pane_id[1:])] = terminal
-    return pane_index, order
-
-
-def _convert_vertical_to_vpane(result, parent_name, vertical_or_children,
-                               pane_index, order):
-    return _convert_container_to_terminator_pane(
-            result, parent_name, vertical_or_children, pane_index, Vertical,
-            order)
-
-
-def _convert_horizontal_to_hpane(result, parent_name, horizontal_or_children,
-                                 pane_index, order):
-    return _convert_container_to_terminator_pane(
-            result, parent_name, horizontal_or_children, pane_index,
-            Horizontal, order)
-
-
-def _convert_container_to_terminator_pane(result, parent_name,
-                                          container_or_children,
-                                          pane_index, pane_type,
-                                          order):
-    terminator_type = 'VPaned' if issubclass(pane_type, Vertical) else 'HPaned'
-    if isinstance(container_or_children, pane_type):
-        container = container_or_children
-        pane = _convert(parent_name, terminator_type, container_or_children,
-                        order)
-        order += 1
-        children = container.children
-    else:
-        children = container_or_children
-        if len(children) == 1:
-            child = children[0]
-            child_converter = _get_converter(child)
-            return child_converter(result, parent_name, child, pane_index,
-                                   order)
-        pane = {
-            'type': terminator_type,
-            'parent': parent_name
-        }
-    pane_name = 'pane{}'.format(pane_index)
-    result[pane_name] = pane
-    parent_name = pane_name
-    pane_index += 1
-    child1 = children[0]
-    child1_converter = _get_converter(child1)
-    pane_index, order = child1_converter(result, parent_name, child1,
-                                         pane_index, order)
-    pane_index, order = _convert_container_to_terminator_pane(result,
-                                                              parent_name,
-                                                              children[1:],
-                                                              pane_index,
-                                                              pane_type,
-                                                              order)
-    return pane_index, order
-
-
-converters = {
-    Pane: _covert_pane_to_terminal,
-    Vertical: _convert_vertical_to_vpane,
-    Horizontal: _convert_horizontal_to_hpane
+PANED_TYPES = {
+    Vertical: ('VPaned', 'height'),
+    Horizontal: ('HPaned', 'width')
 }
 
-
-def _get_converter(container):
-    try:
-        return converters[type(container)]
-    except KeyError:
-        raise ValueError('Illegal window layout: {}'.format(container))
-
-
-def _convert(parent_name, type_name, container, order):
-    assert isinstance(container, Container)
-    return {
-        'type': type_name,
-        'parent': parent_name,
-        'order': order,
-        'tmux': {
-            'width': container.width,
-            'height': container.height,
-            'x': container.x,
-            'y': container.y
-        }
-    }
+TMUX_CONTAINER_TYPES = {
+    'VPaned': Vertical,
+    'HPaned': Horizontal
+}
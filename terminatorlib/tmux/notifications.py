@@ -1,6 +1,7 @@
 from gi.repository import GObject
 
 from terminatorlib.util import dbg
+from terminatorlib.tmux import history
 from terminatorlib.tmux import layout
 
 import string
@@ -192,7 +193,10 @@ class NotificationsHandler(object):
 
     def __init__(self, terminator):
         self.terminator = terminator
-        self.layout_parser = layout.LayoutParser()
+        self.layout_cache = layout.LayoutCache()
+        self.window_pane_ids = {}
+        # panes seen going away in a layout change, or with their window
+        self.closed_pane_ids = set()
 
     def handle(self, notification):
         try:
@@ -203,11 +207,14 @@ class NotificationsHandler(object):
             pass
 
     def handle_begin(self, notification):
-        dbg('### {}'.format(notification))
+        dbg('### %s', notification)
         assert isinstance(notification, Result)
-        callback = self.terminator.tmux_control.requests.get()
+        callback = self.next_callback()
         if notification.error:
-            dbg('Request error: {}'.format(notification))
+            dbg('Request error: %s', notification)
+            sequence = getattr(callback, 'sequence', None)
+            if sequence is not None:
+                sequence.fail()
             if notification.result[0] in ATTACH_ERROR_STRINGS:
                 # if we got here it means that attaching to an existing session
                 # failed, invalidate the layout so the Terminator initialization
@@ -217,12 +224,28 @@ class NotificationsHandler(object):
             return
         callback(notification.result)
 
+    def next_callback(self):
+        """Return the callback of the command this result is for, skipping
+        those of the commands of a failed sequence, which tmux never ran"""
+        requests = self.terminator.tmux_control.requests
+        callback = requests.get()
+        while getattr(callback, 'sequence', None) is not None and \
+              callback.sequence.failed:
+            dbg('dropping the callback of a command that never ran')
+            callback = requests.get()
+        return callback
+
     def handle_output(self, notification):
         assert isinstance(notification, Output)
         pane_id = notification.pane_id
         output = notification.output
         terminal = self.terminator.pane_id_to_terminal.get(pane_id)
         if not terminal:
+            # the tab of this pane hasn't been shown yet; it captures the
+            # pane contents once it is, so only keep count of the output
+            placeholder = self.terminator.pane_id_to_placeholder.get(pane_id)
+            if placeholder:
+                placeholder.count_output(pane_id, output)
             return
         for code in ALTERNATE_SCREEN_ENTER_CODES:
             if code in output:
@@ -230,6 +253,16 @@ class NotificationsHandler(object):
         for code in ALTERNATE_SCREEN_EXIT_CODES:
             if code in output:
                 self.terminator.tmux_control.alternate_on = False
+        if terminal.tmux_history:
+            # the history pages are counted from the screen, which is
+            # about to move, and the history grows
+            terminal.tmux_history.clear()
+            terminal.tmux_history_size = None
+        if terminal.tmux_offscreen or terminal.tmux_catching_up:
+            # nobody sees this output; capture-pane gets the result of it
+            # once the terminal is shown again
+            terminal.tmux_missed_output = True
+            return
         # NOTE: using neovim, enabling visual-bell and setting t_vb empty results in incorrect
         # escape sequences (C-g) being printed in the neovim window; remove them until we can
         # figure out the root cause
@@ -237,10 +270,28 @@ class NotificationsHandler(object):
 
     def handle_layout_change(self, notification):
         assert isinstance(notification, LayoutChange)
+        try:
+            pane_ids = frozenset(layout.get_pane_ids(
+                self.layout_cache.parse(notification.window_layout)))
+        except ValueError as ex:
+            dbg('Unable to parse layout: {}'.format(ex))
+            pane_ids = None
+        # a layout change that only moves or resizes panes (e.g. dragging
+        # the window around) doesn't require us to look for closed panes
+        if pane_ids is not None and \
+                self.window_pane_ids.get(notification.window_id) == pane_ids:
+            return
+        old_pane_ids = self.window_pane_ids.get(notification.window_id)
+        if old_pane_ids and pane_ids is not None:
+            self.closed_pane_ids.update(old_pane_ids - pane_ids)
+        self.window_pane_ids[notification.window_id] = pane_ids
         GObject.idle_add(self.terminator.tmux_control.garbage_collect_panes)
 
     def handle_window_close(self, notification):
         assert isinstance(notification, WindowClose)
+        old_pane_ids = self.window_pane_ids.pop(notification.window_id, None)
+        if old_pane_ids:
+            self.closed_pane_ids.update(old_pane_ids)
         GObject.idle_add(self.terminator.tmux_control.garbage_collect_panes)
 
     def pane_id_result(self, result):
@@ -258,10 +309,13 @@ class NotificationsHandler(object):
 
     def garbage_collect_panes_result(self, result):
         pane_id_to_terminal = self.terminator.pane_id_to_terminal
+        pane_id_to_placeholder = self.terminator.pane_id_to_placeholder
         removed_pane_ids = pane_id_to_terminal.keys()
+        removed_placeholder_pane_ids = set(pane_id_to_placeholder.keys())
 
         for line in result:
             pane_id, pane_pid = line.split(' ')
+            removed_placeholder_pane_ids.discard(pane_id)
             try:
                 removed_pane_ids.remove(pane_id)
                 pane_id_to_terminal[pane_id].pid = pane_pid
@@ -269,34 +323,128 @@ class NotificationsHandler(object):
                 dbg("Pane already reaped, keep going.")
                 continue
 
-        if removed_pane_ids:
+        if removed_pane_ids or removed_placeholder_pane_ids:
             def callback():
                 for pane_id in removed_pane_ids:
                     terminal = pane_id_to_terminal.pop(pane_id, None)
                     if terminal:
                         terminal.close()
+                for pane_id in removed_placeholder_pane_ids:
+                    placeholder = pane_id_to_placeholder.get(pane_id)
+                    if placeholder:
+                        placeholder.remove_pane(pane_id)
                 return False
             GObject.idle_add(callback)
 
     def initial_layout_result(self, result):
         window_layouts = []
         for line in result:
-            window_layout = line.strip()
-            window_layouts.extend(layout.parse_layout(self.layout_parser.parse(window_layout)[0]))
-            # window_layouts.append(layout.parse_layout(window_layout))
-        terminator_layout = layout.convert_to_terminator_layout(
-                window_layouts)
+            window_id, window_layout = line.strip().split(' ', 1)
+            window_layouts.append(window_layout)
+            # so panes closed before the next layout change of the window
+            # are noticed
+            try:
+                self.window_pane_ids[window_id] = frozenset(
+                    layout.get_pane_ids(self.layout_cache.parse(window_layout)))
+            except ValueError as ex:
+                dbg('Unable to parse layout: {}'.format(ex))
+        if len(window_layouts) == 1:
+            terminator_layout = self.layout_cache.convert(window_layouts[0])
+        else:
+            terminator_layout = layout.convert_to_terminator_layout(
+                [self.layout_cache.parse(window_layout)
+                 for window_layout in window_layouts])
         import pprint
         dbg(pprint.pformat(terminator_layout))
+        dbg(self.layout_cache)
         self.terminator.initial_layout = terminator_layout
 
-    def initial_output_result_callback(self, pane_id):
+    def capture_result_callback(self, captured):
+        """Keep the lines of a capture-pane for the command after it"""
+        def result_callback(result):
+            captured['lines'] = result
+        return result_callback
+
+    def initial_output_result_callback(self, pane_id, captured):
+        def result_callback(result):
+            terminal = self.terminator.pane_id_to_terminal.get(pane_id)
+            if not terminal:
+                return
+            feed_capture(terminal, captured.get('lines', []), result)
+        return result_callback
+
+    def catch_up_output_result_callback(self, pane_id, captured):
         def result_callback(result):
             terminal = self.terminator.pane_id_to_terminal.get(pane_id)
             if not terminal:
                 return
-            output = '\r\n'.join(l for l in result if l)
+            terminal.tmux_catching_up = False
+            if terminal.tmux_offscreen:
+                # hidden again before tmux replied, catch up next time
+                return
+            terminal.tmux_missed_output = False
+            terminal.vte.reset(True, True)
+            feed_capture(terminal, captured.get('lines', []), result)
+        return result_callback
+
+    def catch_up_output_error_callback(self, pane_id):
+        def error_callback():
+            terminal = self.terminator.pane_id_to_terminal.get(pane_id)
+            if terminal:
+                # try again the next time it is shown
+                terminal.tmux_catching_up = False
+        return error_callback
+
+    def history_page_result_callback(self, pane_id, page, fetched):
+        def result_callback(result):
+            fetched[page] = result
+            terminal = self.terminator.pane_id_to_terminal.get(pane_id)
+            if terminal and page != 'screen':
+                terminal.tmux_history.put(page, result)
+        return result_callback
+
+    def history_error_callback(self, pane_id, pages):
+        def error_callback():
+            terminal = self.terminator.pane_id_to_terminal.get(pane_id)
+            if not terminal:
+                return
+            dbg('loading {} history pages of {} failed'.format(pages, pane_id))
+            terminal.tmux_history_loading = False
+        return error_callback
+
+    def history_result_callback(self, pane_id, pages, fetched, distance,
+                                offset):
+        def result_callback(result):
+            terminal = self.terminator.pane_id_to_terminal.get(pane_id)
+            if not terminal:
+                return
+            terminal.tmux_history_loading = False
+            cursor_x, cursor_y, history_size = [
+                int(value) for value in result[0].split(' ')]
+            terminal.tmux_history_size = history_size
+
+            lines = []
+            for page in xrange(pages - 1, -1, -1):
+                if offset + page * history.PAGE_LINES >= history_size:
+                    # tmux clamps the range to the start of the history
+                    continue
+                page_lines = fetched.get(page)
+                if page_lines is None:
+                    page_lines = terminal.tmux_history.get(page)
+                if page_lines is None:
+                    # cleared by output arriving meanwhile, next scroll
+                    # will fetch it again
+                    dbg('history page {} of {} went away'.format(
+                        page, pane_id))
+                    return
+                lines.extend(page_lines)
+
+            terminal.set_tmux_history(pages, len(lines))
+            output = '\r\n'.join(lines + fetched.get('screen', []))
+            terminal.vte.reset(True, True)
             terminal.vte.feed(output.decode('string_escape'))
+            terminal.vte.feed('\033[{};{}H'.format(cursor_y + 1, cursor_x + 1))
+            GObject.idle_add(terminal.scroll_to_tmux_history, distance)
         return result_callback
 
     def terminate(self):
@@ -306,5 +454,40 @@ class NotificationsHandler(object):
         GObject.idle_add(callback)
 
 
+class CommandSequence(object):
+    """The commands sent as a single tmux command sequence. tmux stops it at
+    its first failing command and replies to that one only, with an error,
+    so the callbacks of the commands after it must be dropped"""
+
+    failed = False
+    errback = None
+
+    def __init__(self, errback=None):
+        """Class initialiser, errback is called if the sequence fails"""
+        self.errback = errback
+
+    def callback(self, callback):
+        """Return callback as the callback of one command of the sequence"""
+        def sequence_callback(result):
+            return callback(result)
+        sequence_callback.sequence = self
+        return sequence_callback
+
+    def fail(self):
+        """One of the commands failed, the ones after it never run"""
+        self.failed = True
+        if self.errback:
+            self.errback()
+
+
+def feed_capture(terminal, lines, cursor):
+    """Feed the lines of a capture-pane to a terminal, blank ones included
+    so the screen keeps its shape, then move the cursor to where tmux has
+    it, given as the "cursor_y,cursor_x" result of display"""
+    terminal.vte.feed('\r\n'.join(lines).decode('string_escape'))
+    cursor_y, cursor_x = [int(value) for value in cursor[0].split(',')]
+    terminal.vte.feed('\033[{};{}H'.format(cursor_y + 1, cursor_x + 1))
+
+
 def noop(result):
     pass
@@ -20,14 +20,15 @@ import sys
 import cairo
 import os
 import pwd
-import inspect
+import collections
+import signal
 import uuid
 import subprocess
 import gi
 
 try:
     gi.require_version('Gtk','3.0')
-    from gi.repository import Gtk, Gdk
+    from gi.repository import Gtk, Gdk, GLib
 except ImportError:
     print('You need Gtk 3.0+ to run Remotinator.')
     sys.exit(1)
@@ -40,33 +41,88 @@ DEBUGFILES = False
 DEBUGCLASSES = []
 # list of methods to show debugging for. empty list means show all methods
 DEBUGMETHODS = []
+# set this to true to only keep debugging output in DEBUGLOG
+DEBUGQUIET = False
+# the latest debugging messages, see dump_debug_log()
+DEBUGLOG = collections.deque(maxlen=10000)
+# (class, method) -> whether DEBUGCLASSES and DEBUGMETHODS let it through
+DEBUGFILTERED = {}
+
+def set_debug_filters(classes=None, methods=None):
+    """Limit debugging output to some classes and methods"""
+    DEBUGCLASSES[:] = classes or []
+    DEBUGMETHODS[:] = methods or []
+    DEBUGFILTERED.clear()
+
+def debug_allowed(classname, method):
+    """Check a class and method against the debugging filters, the answer
+    is worked out once for each of them
+
+    >>> set_debug_filters(['Terminal'])
+    >>> debug_allowed('Terminal', 'spawn_child'), debug_allowed('Window', 'show')
+    (True, False)
+    >>> set_debug_filters()
+    """
+    key = (classname, method)
+    try:
+        return(DEBUGFILTERED[key])
+    except KeyError:
+        allowed = (DEBUGCLASSES == [] or classname in DEBUGCLASSES) and \
+                  (DEBUGMETHODS == [] or method in DEBUGMETHODS)
+        DEBUGFILTERED[key] = allowed
+        return(allowed)
 
-def dbg(log = ""):
-    """Print a message if debugging is enabled"""
-    if DEBUG:
-        stackitem = inspect.stack()[1]
-        parent_frame = stackitem[0]
-        method = parent_frame.f_code.co_name
-        names, varargs, keywords, local_vars = inspect.getargvalues(parent_frame)
-        try:
-            self_name = names[0]
-            classname = local_vars[self_name].__class__.__name__
-        except IndexError:
-            classname = "noclass"
-        if DEBUGFILES:
-            line = stackitem[2]
-            filename = parent_frame.f_code.co_filename
-            extra = " (%s:%s)" % (filename, line)
-        else:
-            extra = ""
-        if DEBUGCLASSES != [] and classname not in DEBUGCLASSES:
-            return
-        if DEBUGMETHODS != [] and method not in DEBUGMETHODS:
-            return
+def dbg(log = "", *args):
+    """Print a message if debugging is enabled. Any args are only formatted
+    into log if it is, so pass them rather than formatting the message:
+
+    dbg('checking: %s (%s)', terminal.pane_id, terminal)"""
+    if not DEBUG:
+        return
+    parent_frame = sys._getframe(1)
+    code = parent_frame.f_code
+    method = code.co_name
+    classname = "noclass"
+    if code.co_argcount > 0:
         try:
-            print >> sys.stderr, "%s::%s: %s%s" % (classname, method, log, extra)
-        except IOError:
+            classname = parent_frame.f_locals[code.co_varnames[0]].__class__.__name__
+        except KeyError:
             pass
+    if (DEBUGCLASSES != [] or DEBUGMETHODS != []) and \
+       not debug_allowed(classname, method):
+        return
+    if args:
+        log = log % args
+    if DEBUGFILES:
+        extra = " (%s:%s)" % (code.co_filename, parent_frame.f_lineno)
+    else:
+        extra = ""
+    message = "%s::%s: %s%s" % (classname, method, log, extra)
+    DEBUGLOG.append(message)
+    if DEBUGQUIET:
+        return
+    try:
+        print >> sys.stderr, message
+    except IOError:
+        pass
+
+def dump_debug_log_on_signal(signum=signal.SIGUSR1):
+    """Write out the latest debugging messages whenever we get signum"""
+    def on_signal(*_args):
+        dump_debug_log()
+        return(True)
+    GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signum, on_signal)
+
+def dump_debug_log(output=None):
+    """Write out the latest debugging messages, to stderr by default"""
+    if output is None:
+        output = sys.stderr
+    try:
+        for message in list(DEBUGLOG):
+            print >> output, message
+        output.flush()
+    except IOError:
+        pass
 
 def err(log = ""):
     """Print an error message"""
@@ -155,6 +211,51 @@ def shell_lookup():
                 return(rshell)
     dbg('shell_lookup: Unable to locate a shell')
 
+def process_is(pid, name, uid):
+    """Check from /proc whether a process has the given name and owner"""
+    try:
+        if os.stat('/proc/%s' % pid).st_uid != uid:
+            return(False)
+        with open('/proc/%s/comm' % pid) as comm:
+            return(comm.read().strip() == name)
+    except (IOError, OSError):
+        return(False)
+
+def ibus_daemon_running():
+    """Find out whether the user runs ibus-daemon. The daemon writes its
+    pid in the address files under ~/.config/ibus/bus, so those are checked
+    first; failing that, /proc is scanned up to the first match"""
+    uid = os.getuid()
+    busdir = os.path.join(os.environ.get('XDG_CONFIG_HOME',
+                                         os.path.expanduser('~/.config')),
+                          'ibus', 'bus')
+    try:
+        addresses = os.listdir(busdir)
+    except OSError:
+        addresses = []
+    for address in addresses:
+        try:
+            with open(os.path.join(busdir, address)) as addressfile:
+                for line in addressfile:
+                    if line.startswith('IBUS_DAEMON_PID='):
+                        pid = int(line.split('=', 1)[1])
+                        if process_is(pid, 'ibus-daemon', uid):
+                            dbg('ibus_daemon_running: pid %d from %s' %
+                                (pid, address))
+                            return(True)
+        except (IOError, ValueError):
+            continue
+
+    try:
+        pids = os.listdir('/proc')
+    except OSError:
+        return(False)
+    for pid in pids:
+        if pid.isdigit() and process_is(pid, 'ibus-daemon', uid):
+            dbg('ibus_daemon_running: found pid %s' % pid)
+            return(True)
+    return(False)
+
 def widget_pixbuf(widget, maxsize=None):
     """Generate a pixbuf of a widget"""
     # FIXME: Can this be changed from using "import cairo" to "from gi.repository import cairo"?
@@ -309,6 +410,96 @@ def enumerate_descendants(parent):
         len(terminals), parent))
     return(containers, terminals)
 
+def wind_layout(layout):
+    """Turn a flat layout, as stored in the config, into a hierarchy of
+    Windows whose children are nested in 'children' dicts. Objects whose
+    parent doesn't exist are dropped. The layout itself is left untouched
+
+    >>> layout = {'window0': {'type': 'Window', 'parent': ''},
+    ...           'child1': {'type': 'Terminal', 'parent': 'window0'}}
+    >>> hierarchy = wind_layout(layout)
+    >>> hierarchy['window0']['children']['child1']['type']
+    'Terminal'
+    >>> 'parent' in hierarchy['window0']
+    False
+    """
+    hierarchy = {}
+    children = {}
+
+    # Index every object by its parent, making the windows as we go
+    for name, obj in layout.iteritems():
+        if obj['type'].lower() == 'window':
+            window = {'type': 'Window', 'children': {}}
+            for key, value in obj.iteritems():
+                if value != '' and not window.has_key(key):
+                    window[key] = value
+            hierarchy[name] = window
+        elif not obj.has_key('parent'):
+            err('Invalid object: %s' % name)
+        else:
+            children.setdefault(obj['parent'], []).append(name)
+
+    # Then walk down from the windows, attaching each object to its parent
+    pending = hierarchy.items()
+    while pending:
+        parent_name, parent = pending.pop()
+        for name in children.pop(parent_name, []):
+            obj = layout[name]
+            child = {'type': obj['type'], 'children': {}}
+            for key, value in obj.iteritems():
+                if not child.has_key(key):
+                    child[key] = value
+            parent['children'][name] = child
+            pending.append((name, child))
+
+    for parent_name in children:
+        err('layout objects %s have a missing parent: %s' %
+            (', '.join(children[parent_name]), parent_name))
+
+    return(hierarchy)
+
+def remove_pane_from_layout(layout, pane_id):
+    """Remove the Terminal of a tmux pane from a nested layout, as made by
+    wind_layout. The Paned it was in is replaced by its other child. Return
+    the layout, which is that child if the Paned was at the top, or None if
+    the Terminal was
+
+    >>> layout = {'type': 'HPaned', 'order': 2, 'children': {
+    ...     'terminal1': {'type': 'Terminal', 'order': 0, 'pane_id': '%1'},
+    ...     'terminal2': {'type': 'Terminal', 'order': 1, 'pane_id': '%2'}}}
+    >>> layout = remove_pane_from_layout(layout, '%1')
+    >>> layout['pane_id'], layout['order']
+    ('%2', 2)
+    >>> remove_pane_from_layout(layout, '%2') is None
+    True
+    """
+    parents = {}
+    pending = [layout]
+    while pending:
+        obj = pending.pop()
+        if obj.get('pane_id') == pane_id:
+            break
+        for name, child in obj.get('children', {}).iteritems():
+            parents[id(child)] = (obj, name)
+            pending.append(child)
+    else:
+        return(layout)
+
+    if obj is layout:
+        return(None)
+    paned, name = parents[id(obj)]
+    del(paned['children'][name])
+    # The other child takes the place of the Paned
+    survivor = paned['children'].values()[0]
+    for key in ('parent', 'order'):
+        if paned.has_key(key):
+            survivor[key] = paned[key]
+    if paned is layout:
+        return(survivor)
+    grandparent, name = parents[id(paned)]
+    grandparent['children'][name] = survivor
+    return(layout)
+
 def get_column_row_count(window):
     column_sum = 0
     row_sum = 0
@@ -18,14 +18,23 @@ from container import Container
 from factory import Factory
 from terminator import Terminator
 
-if display_manager() == 'X11':
-    try:
-        gi.require_version('Keybinder', '3.0')
-        from gi.repository import Keybinder
-        Keybinder.init()
-    except (ImportError, ValueError):
-        err('Unable to load Keybinder module. This means the \
+KEYBINDER = None
+
+def get_keybinder():
+    """Load Keybinder the first time a window binds its hotkey. Returns
+    False if it isn't available"""
+    global KEYBINDER
+    if KEYBINDER is None:
+        KEYBINDER = False
+        try:
+            gi.require_version('Keybinder', '3.0')
+            from gi.repository import Keybinder
+            Keybinder.init()
+            KEYBINDER = Keybinder
+        except (ImportError, ValueError):
+            err('Unable to load Keybinder module. This means the \
 hide_window shortcut will be unavailable')
+    return(KEYBINDER)
 
 # pylint: disable-msg=R0904
 class Window(Container, Gtk.Window):
@@ -96,6 +105,7 @@ class Window(Container, Gtk.Window):
 
         self.apply_icon(icon_to_apply)
         self.pending_set_rough_geometry_hint = False
+        self.pending_focus = False
 
     def do_get_property(self, prop):
         """Handle gobject getting a property"""
@@ -120,16 +130,18 @@ class Window(Container, Gtk.Window):
         self.connect('window-state-event', self.on_window_state_changed)
         self.connect('focus-out-event', self.on_focus_out)
         self.connect('focus-in-event', self.on_focus_in)
+        self.connect('map-event', self.on_map)
 
         # Attempt to grab a global hotkey for hiding the window.
         # If we fail, we'll never hide the window, iconifying instead.
         if self.config['keybindings']['hide_window'] != None:
             if display_manager() == 'X11':
+                keybinder = get_keybinder()
                 try:
-                    self.hidebound = Keybinder.bind(
+                    self.hidebound = keybinder.bind(
                         self.config['keybindings']['hide_window'].replace('<Shift>',''),
                         self.on_hide_window)
-                except (KeyError, NameError):
+                except (KeyError, AttributeError):
                     pass
 
                 if not self.hidebound:
@@ -235,11 +247,41 @@ class Window(Container, Gtk.Window):
 
     def on_focus_in(self, window, event):
         """Focus has entered the window"""
+        # The window manager already did what a deferred request would
+        self.pending_focus = False
         self.set_urgency_hint(False)
         if not self.terminator.doing_layout:
             self.terminator.last_active_window = self.uuid
         # FIXME: Cause the terminal titlebars to update here
 
+    def on_map(self, window, event):
+        """The window has been mapped, it can be given the focus now"""
+        if self.pending_focus:
+            GObject.idle_add(self.do_deferred_focus)
+        return False
+
+    def request_focus(self):
+        """Ask for the focus once the window is mapped. Any number of calls
+        result in at most one focus request"""
+        if self.pending_focus:
+            return
+        self.pending_focus = True
+        if self.get_mapped():
+            GObject.idle_add(self.do_deferred_focus)
+
+    def do_deferred_focus(self):
+        """Give the focus to the window, unless it got it meanwhile"""
+        if not self.pending_focus:
+            return False
+        self.pending_focus = False
+        try:
+            t = GdkX11.x11_get_server_time(self.get_window())
+        except (TypeError, AttributeError):
+            t = 0
+        self.present_with_time(t)
+        self.grab_focus()
+        return False
+
     def is_child_notebook(self):
         """Returns True if this Window's child is a Notebook"""
         maker = Factory()
@@ -262,8 +304,9 @@ class Window(Container, Gtk.Window):
         if not self.is_child_notebook():
             dbg('Making a new Notebook')
             notebook = maker.make('Notebook', window=self)
-        self.show()
-        self.present()
+        if not self.terminator.doing_layout:
+            self.show()
+            self.present()
         return self.get_child().newtab(debugtab, cwd=cwd, profile=profile)
 
     def on_delete_event(self, window, event, data=None):
@@ -395,6 +438,17 @@ class Window(Container, Gtk.Window):
             self.hide()
 
 
+    def show_layout(self):
+        """Show a window whose layout was built while it was hidden. Its
+        Paneds get their positions from their ratios on the first allocation"""
+        def on_size_allocate(window, allocation):
+            self.set_pos_by_ratio = False
+            self.disconnect(handler)
+
+        self.set_pos_by_ratio = True
+        handler = self.connect('size-allocate', on_size_allocate)
+        self.show(True)
+
     def add(self, widget, metadata=None):
         """Add a widget to the window by way of Gtk.Window.add()"""
         maker = Factory()
@@ -488,9 +542,10 @@ class Window(Container, Gtk.Window):
         for term in order:
             container.add(term)
         container.show_all()
-        
-        while Gtk.events_pending():
-            Gtk.main_iteration_do(False)
+
+        if not self.terminator.doing_layout:
+            while Gtk.events_pending():
+                Gtk.main_iteration_do(False)
         sibling.grab_focus()
         self.set_pos_by_ratio = False
 
@@ -585,6 +640,9 @@ class Window(Container, Gtk.Window):
             terminals.update(child.get_visible_terminals())
         elif maker.isinstance(child, 'Terminal'):
             terminals[child] = child.get_allocation()
+        elif maker.isinstance(child, 'TabPlaceholder'):
+            # The tab is about to be built by Notebook.on_tab_switch
+            pass
         else:
             err('Unknown child type %s' % type(child))
 
@@ -877,11 +935,16 @@ class Window(Container, Gtk.Window):
         elif child['type'] == 'HPaned':
             self.split_axis(terminal, False)
         elif child['type'] == 'Notebook':
-            self.tab_new()
-            i = 2
-            while i < len(child['children']):
+            if self.terminator.tmux_control and self.terminator.initial_layout:
+                # Attaching to tmux, Notebook.create_layout makes the
+                # hidden tabs as placeholders
+                Factory().make('Notebook', window=self)
+            else:
                 self.tab_new()
-                i = i + 1
+                i = 2
+                while i < len(child['children']):
+                    self.tab_new()
+                    i = i + 1
         elif child['type'] == 'Terminal':
             pass
         else:
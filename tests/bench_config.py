@@ -0,0 +1,53 @@
+#!/usr/bin/env python2
+"""Time the config reads a terminal makes per keypress, through the profile
+snapshots and through ConfigBase.get_item as every read used to:
+
+    python2 tests/bench_config.py [keypresses]
+"""
+
+import os
+import sys
+import time
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from terminatorlib import util
+from terminatorlib.config import Config
+
+# what a keypress, and the redraws and title updates following it, look up
+KEYS = ['smart_copy', 'scroll_on_keystroke', 'focus', 'always_split_with_profile',
+        'title_transmit_fg_color', 'title_inactive_fg_color', 'cursor_color',
+        'keybindings', 'broadcast_default', 'use_custom_url_handler']
+
+
+def snapshot_reads(config, count):
+    start = time.time()
+    for _ in xrange(count):
+        for key in KEYS:
+            config[key]
+    return time.time() - start
+
+
+def get_item_reads(config, count):
+    base = config.base
+    profile = config.profile
+    start = time.time()
+    for _ in xrange(count):
+        for key in KEYS:
+            base.get_item(key, profile)
+    return time.time() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    config = Config()
+    config['scroll_on_keystroke']
+    for debug in (False, True):
+        util.DEBUG = debug
+        util.DEBUGQUIET = True
+        print 'debug %-3s  get_item: %6.2fus  snapshot: %6.2fus  per keypress' % (
+            debug and 'on' or 'off',
+            get_item_reads(config, count) * 1e6 / count,
+            snapshot_reads(config, count) * 1e6 / count)
+
+if __name__ == '__main__':
+    main()
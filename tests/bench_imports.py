@@ -0,0 +1,27 @@
+#!/usr/bin/env python2
+"""Time the imports of the terminator script and the widgets of a first
+window, gi included, each in a fresh interpreter:
+
+    python2 tests/bench_imports.py [runs]
+"""
+
+import sys
+
+from test_imports import import_startup_modules
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    times = []
+    for _ in xrange(runs):
+        result = import_startup_modules()
+        if result is None:
+            print 'gi is not available'
+            return
+        times.append(result['seconds'])
+    # the first run may pay for a cold disk cache
+    print 'startup imports: best %.1fms  first %.1fms  of %d runs' % (
+        min(times) * 1000, times[0] * 1000, runs)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python2
+"""Compare the Searchbar's Python search with VTE's own PCRE2 search.
+
+Needs a display. Fills a VTE with a large scrollback, then times finding a
+line near its top, and a string that isn't there at all, with both engines:
+
+    python2 tests/bench_search.py [lines]
+"""
+
+import os
+import sys
+import time
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+import gi
+gi.require_version('Gtk', '3.0')
+gi.require_version('Vte', '2.91')
+from gi.repository import Gtk, Vte
+
+from terminatorlib.searchbar import Searchbar
+
+
+class FakeTerminator(object):
+
+    tmux_control = None
+
+
+class SearchHost(Gtk.VBox):
+    """Stands in for the Terminal a Searchbar lives in"""
+
+    def __init__(self, lines):
+        Gtk.VBox.__init__(self)
+        self.terminator = FakeTerminator()
+        self.vte = Vte.Terminal()
+        self.vte.set_scrollback_lines(lines + 100)
+        self.searchbar = Searchbar()
+        self.pack_start(self.vte, True, True, 0)
+        self.pack_start(self.searchbar, False, False, 0)
+        self.hit = None
+        for start in xrange(0, lines, 1000):
+            self.vte.feed(''.join('line %d of the scrollback\r\n' % line
+                                  for line in xrange(start, start + 1000)))
+
+    def scrollbar_jump(self, row):
+        self.hit = row
+
+
+def wait_for(condition):
+    while not condition():
+        Gtk.main_iteration()
+
+
+def python_search(host, text):
+    searchbar = host.searchbar
+    searchbar.native_search = False
+    searchbar.end_search()
+    searchbar.entry.set_text(text)
+    searchbar.contents_generation += 1
+    host.hit = None
+    start = time.time()
+    searchbar.do_search(None)
+    wait_for(lambda: host.hit is not None or
+             searchbar.snapshot_worker is None and searchbar.hits is not None)
+    return time.time() - start
+
+
+def native_search(host, text):
+    searchbar = host.searchbar
+    searchbar.native_search = True
+    searchbar.end_search()
+    searchbar.entry.set_text(text)
+    start = time.time()
+    searchbar.do_search(None)
+    return time.time() - start
+
+
+def main():
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    window = Gtk.Window()
+    host = SearchHost(lines)
+    window.add(host)
+    window.show_all()
+    host.searchbar.start_search()
+    wait_for(lambda: not Gtk.events_pending())
+
+    native = host.searchbar.native_search
+    for text in ('^line 10 of', 'not in the scrollback'):
+        print '%-24s python: %8.1fms' % (text, python_search(host, text) * 1000),
+        if native:
+            print ' vte: %8.1fms' % (native_search(host, text) * 1000)
+        else:
+            print ' vte: unavailable'
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from terminatorlib import config
+from terminatorlib.util import get_config_dir
+
+CONFIG = """[global_config]
+  focus = sloppy
+[profiles]
+  [[default]]
+    scrollback_lines = 5000
+[layouts]
+  [[mine]]
+    [[[window0]]]
+      type = Window
+      parent = ""
+"""
+
+
+class ConfigCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.xdg = tempfile.mkdtemp()
+        self.saved_xdg = os.environ.get('XDG_CONFIG_HOME')
+        os.environ['XDG_CONFIG_HOME'] = self.xdg
+        os.makedirs(get_config_dir())
+        self.filename = os.path.join(get_config_dir(), 'config')
+        self.cachefile = os.path.join(get_config_dir(), config.CACHE_FILE)
+        self.write_config(CONFIG)
+        self.base = config.ConfigBase()
+
+    def tearDown(self):
+        # Back to the defaults, without touching the real config dir
+        os.unlink(self.filename)
+        self.reload()
+        if self.saved_xdg is None:
+            del os.environ['XDG_CONFIG_HOME']
+        else:
+            os.environ['XDG_CONFIG_HOME'] = self.saved_xdg
+        shutil.rmtree(self.xdg)
+
+    def write_config(self, text):
+        with open(self.filename, 'w') as configfile:
+            configfile.write(text)
+
+    def reload(self):
+        base = config.ConfigBase()
+        for name in base.sections:
+            setattr(base, name, None)
+        base.prepare_attributes()
+        base.reload()
+        return base
+
+    def test_cache_written_and_used(self):
+        base = self.reload()
+        self.assertTrue(os.path.exists(self.cachefile))
+        parsed = dict((name, getattr(base, name)) for name in base.sections)
+
+        self.base.parse = None  # loading must not need to parse again
+        base = self.reload()
+        del self.base.parse
+        cached = dict((name, getattr(base, name)) for name in base.sections)
+        self.assertEqual(cached, parsed)
+        self.assertEqual(base.global_config['focus'], 'sloppy')
+        self.assertEqual(base.profiles['default']['scrollback_lines'], 5000)
+
+    def test_changed_config_is_parsed(self):
+        self.reload()
+        self.write_config(CONFIG.replace('sloppy', 'mouse') + '\n')
+        base = self.reload()
+        self.assertEqual(base.global_config['focus'], 'mouse')
+
+    def test_changed_defaults_are_parsed(self):
+        self.reload()
+        self.assertNotEqual(self.base.load_cache(self.filename), None)
+        saved_digest = config.DEFAULTS_DIGEST
+        config.DEFAULTS_DIGEST = 'other defaults'
+        try:
+            self.assertEqual(self.base.load_cache(self.filename), None)
+        finally:
+            config.DEFAULTS_DIGEST = saved_digest
+
+    def test_invalid_config_not_cached(self):
+        self.write_config(CONFIG.replace('5000', 'lots'))
+        if os.path.exists(self.cachefile):
+            os.unlink(self.cachefile)
+        self.reload()
+        self.assertFalse(os.path.exists(self.cachefile))
+
+
+if __name__ == '__main__':
+    unittest.main()
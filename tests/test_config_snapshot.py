@@ -0,0 +1,58 @@
+import unittest
+
+from terminatorlib.config import Config
+
+
+class ConfigSnapshotTests(unittest.TestCase):
+
+    def setUp(self):
+        self.config = Config()
+        self.config.set_profile('default')
+
+    def tearDown(self):
+        self.config.del_profile('snapshot test')
+        self.config.base.reload()
+
+    def test_snapshot_matches_get_item(self):
+        base = self.config.base
+        snapshot = base.get_snapshot('default')
+        for key in snapshot:
+            self.assertEqual(snapshot[key], base.get_item(key, 'default'))
+
+    def test_set_item_invalidates(self):
+        self.config['focus']
+        self.config['focus'] = 'sloppy'
+        self.assertEqual(self.config['focus'], 'sloppy')
+        self.config['scrollback_lines'] = 1234
+        self.assertEqual(self.config['scrollback_lines'], 1234)
+
+    def test_profiles_kept_apart(self):
+        self.config.add_profile('snapshot test')
+        self.config.set_profile('snapshot test')
+        self.config['scrollback_lines'] = 42
+        self.assertEqual(self.config['scrollback_lines'], 42)
+        self.config.set_profile('default')
+        self.assertNotEqual(self.config['scrollback_lines'], 42)
+
+    def test_missing_profile_uses_default(self):
+        base = self.config.base
+        self.assertEqual(base.get_snapshot('no such profile')['scrollback_lines'],
+                         base.get_item('scrollback_lines', 'default'))
+
+    def test_changed_keys(self):
+        base = self.config.base
+        copies = base.copy_snapshots()
+        self.assertEqual(base.changed_keys(copies)['default'], set())
+        self.config['scrollback_lines'] = 4321
+        self.config['focus'] = 'mouse'
+        copy_binding = base.keybindings['copy']
+        base.keybindings['copy'] = '<Alt>c'
+        self.assertEqual(base.changed_keys(copies)['default'],
+                         set(['scrollback_lines', 'focus', 'keybindings']))
+        base.keybindings['copy'] = copy_binding
+        self.config.add_profile('snapshot test')
+        self.assertEqual(base.changed_keys(copies)['snapshot test'], None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,6 +16,7 @@ def test_suite():
         'cwd',
         'factory',
         'util',
+        'startupprofile',
         'tests.testborg',
         'tests.testsignalman',
         ):
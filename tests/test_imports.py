@@ -0,0 +1,75 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+
+# what the terminator script and the widgets of a first window import
+STARTUP_MODULES = [
+    'terminatorlib.optionparse',
+    'terminatorlib.terminator',
+    'terminatorlib.factory',
+    'terminatorlib.window',
+    'terminatorlib.notebook',
+    'terminatorlib.paned',
+    'terminatorlib.terminal',
+    'terminatorlib.plugin',
+]
+
+# only needed once the user asks for them
+LAZY_MODULES = [
+    'configobj.validate',
+    'terminatorlib.debugserver',
+    'terminatorlib.encoding',
+    'terminatorlib.layoutlauncher',
+    'terminatorlib.prefseditor',
+    'terminatorlib.terminal_popup_menu',
+    'terminatorlib.tmux.control',
+    'terminatorlib.tmux.layout',
+    'terminatorlib.tmux.notifications',
+]
+
+IMPORT_SCRIPT = """
+import json, sys, time
+try:
+    import gi
+except ImportError:
+    sys.exit(77)
+start = time.time()
+for name in %r:
+    __import__(name)
+print json.dumps({'seconds': time.time() - start,
+                  'modules': sorted(sys.modules)})
+"""
+
+
+def import_startup_modules():
+    """Import the startup modules in a fresh interpreter, return how long
+    it took and what got loaded, or None if gi isn't available"""
+    process = subprocess.Popen([sys.executable, '-c',
+                                IMPORT_SCRIPT % STARTUP_MODULES],
+                               cwd=ROOT, stdout=subprocess.PIPE)
+    output = process.communicate()[0]
+    if process.returncode == 77:
+        return None
+    if process.returncode != 0:
+        raise AssertionError('importing the startup modules failed')
+    return json.loads(output.splitlines()[-1])
+
+
+class ImportTests(unittest.TestCase):
+
+    def setUp(self):
+        self.result = import_startup_modules()
+        if self.result is None:
+            self.skipTest('gi is not available')
+
+    def test_lazy_modules_not_imported(self):
+        loaded = set(self.result['modules'])
+        self.assertEqual([name for name in LAZY_MODULES if name in loaded], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import sys
+import unittest
+
+from terminatorlib.tmux import layout as tmux_layout
+from terminatorlib.util import wind_layout
+
+
+def make_nested_layout(objects):
+    """A window holding a chain of HPaneds nested objects deep, with the
+    deepest objects listed first"""
+    layout = {'window0': {'type': 'Window', 'parent': ''}}
+    parent = 'window0'
+    for index in xrange(objects - 1):
+        name = 'child%d' % index
+        layout[name] = {'type': 'HPaned', 'parent': parent, 'order': 0,
+                        'ratio': 0.5}
+        layout['terminal%d' % index] = {'type': 'Terminal', 'parent': name,
+                                        'order': 1, 'profile': 'default'}
+        parent = name
+    return layout
+
+
+def make_tmux_layout(panes):
+    """A tmux window with panes side by side, converted to a layout"""
+    body = '{}x10,0,0{{{}}}'.format(
+        2 * panes - 1,
+        ','.join('1x10,{},0,{}'.format(2 * pane, pane)
+                 for pane in xrange(panes)))
+    root = tmux_layout.LayoutParser().parse(
+        tmux_layout.layout_checksum(body) + ',' + body)
+    return tmux_layout.convert_to_terminator_layout([root])
+
+
+def count_objects(hierarchy):
+    count = 0
+    pending = hierarchy.values()
+    while pending:
+        obj = pending.pop()
+        count += 1
+        pending.extend(obj['children'].values())
+    return count
+
+
+class WindLayoutTests(unittest.TestCase):
+
+    def test_keys(self):
+        layout = {'window0': {'type': 'window', 'parent': '', 'title': 'x'},
+                  'child0': {'type': 'VPaned', 'parent': 'window0',
+                             'order': 0, 'ratio': 0.25}}
+        hierarchy = wind_layout(layout)
+        window = hierarchy['window0']
+        self.assertEqual(window['type'], 'Window')
+        self.assertEqual(window['title'], 'x')
+        self.assertFalse(window.has_key('parent'))
+        self.assertEqual(window['children']['child0'],
+                         {'type': 'VPaned', 'parent': 'window0', 'order': 0,
+                          'ratio': 0.25, 'children': {}})
+        # the layout itself isn't changed
+        self.assertFalse(layout['child0'].has_key('children'))
+
+    def test_orphans(self):
+        layout = {'window0': {'type': 'Window', 'parent': ''},
+                  'child0': {'type': 'HPaned', 'parent': 'missing'},
+                  'child1': {'type': 'HPaned', 'parent': 'child0'},
+                  'child2': {'type': 'HPaned'}}
+        hierarchy = wind_layout(layout)
+        self.assertEqual(hierarchy['window0']['children'], {})
+
+    def test_nested(self):
+        # deeper than the recursion limit, so the layout has to be wound up
+        # without recursing
+        for objects in (10, 100, sys.getrecursionlimit() + 100):
+            layout = make_nested_layout(objects)
+            hierarchy = wind_layout(layout)
+            self.assertEqual(count_objects(hierarchy), len(layout))
+
+    def test_tmux(self):
+        for panes in (10, 100, 1000):
+            layout = make_tmux_layout(panes)
+            hierarchy = wind_layout(layout)
+            self.assertEqual(count_objects(hierarchy), len(layout))
+
+    def test_single_pass(self):
+        # each object's parent is looked up once, not once per object
+        class CountingDict(dict):
+            lookups = 0
+            def __getitem__(self, key):
+                CountingDict.lookups += 1
+                return dict.__getitem__(self, key)
+        layout = make_nested_layout(1000)
+        counted = dict((name, CountingDict(obj))
+                       for name, obj in layout.items())
+        wind_layout(counted)
+        self.assertTrue(CountingDict.lookups < 10 * len(layout),
+                        '%d lookups' % CountingDict.lookups)
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
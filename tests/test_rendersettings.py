@@ -0,0 +1,45 @@
+import unittest
+
+from terminatorlib.config import Config
+from terminatorlib.rendersettings import get_render_settings
+
+
+class RenderSettingsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.config = Config()
+        self.config.set_profile('default')
+        self.config['use_system_font'] = False
+        self.config.add_profile('render test')
+        self.other = Config()
+        self.other.set_profile('render test')
+        self.other['use_system_font'] = False
+
+    def tearDown(self):
+        self.config.del_profile('render test')
+        self.config.base.reload()
+
+    def test_shared_by_profile(self):
+        settings = get_render_settings(self.config)
+        self.assertTrue(get_render_settings(Config()) is settings)
+        self.assertFalse(get_render_settings(self.other) is settings)
+
+    def test_parsed_again_after_edit(self):
+        settings = get_render_settings(self.config)
+        self.config['palette'] = ':'.join(['#000000'] * 16)
+        self.assertFalse(get_render_settings(self.config) is settings)
+
+    def test_kept_when_other_profile_edited(self):
+        settings = get_render_settings(self.config)
+        self.other['palette'] = ':'.join(['#000000'] * 16)
+        self.assertTrue(get_render_settings(self.config) is settings)
+
+    def test_scrollback(self):
+        self.config['scrollback_lines'] = 1234
+        self.assertEqual(get_render_settings(self.config).scrollback_lines, 1234)
+        self.config['scrollback_infinite'] = True
+        self.assertEqual(get_render_settings(self.config).scrollback_lines, -1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import re
+import unittest
+
+from terminatorlib import searchbar
+
+
+class FindMatchingRowsTests(unittest.TestCase):
+
+    def test_rows(self):
+        lines = ['foo', 'x' * 25 + 'foo', '', 'bar foo foo']
+        rows, total, matches = searchbar.find_matching_rows(
+            re.compile('foo', re.MULTILINE), lines, 10)
+        # the second line wraps over rows 1-3, its match is on row 3
+        self.assertEqual(rows, [0, 3, 5])
+        self.assertEqual(total, 7)
+        self.assertEqual(matches, 4)
+
+    def test_chunks(self):
+        lines = ['line %d' % i for i in xrange(3 * searchbar.CHUNK_LINES)]
+        rows, total, matches = searchbar.find_matching_rows(
+            re.compile('^line \\d*7$', re.MULTILINE), lines, 80)
+        self.assertEqual(rows, range(7, len(lines), 10))
+        self.assertEqual(total, len(lines))
+
+    def test_cells(self):
+        # counted in cells rather than bytes: 15 narrow accented
+        # characters take two rows, nine wide ones take two as well since
+        # the tenth cell of the first row can't hold half of one
+        lines = ['\xc3\xa9' * 15, 'foo', '\xe6\x97\xa5' * 9, 'foo',
+                 '\xe6\x97\xa5' * 5 + 'foo']
+        rows, total, matches = searchbar.find_matching_rows(
+            re.compile('foo', re.MULTILINE), lines, 10)
+        self.assertEqual(rows, [2, 5, 7])
+        self.assertEqual(total, 8)
+        self.assertEqual(matches, 3)
+
+    def test_cells_pattern(self):
+        lines = ['x' * 8 + '\xe6\x97\xa5\xe6\x9c\xac']
+        rows, total, matches = searchbar.find_matching_rows(
+            re.compile('\xe6\x9c\xac', re.MULTILINE), lines, 10)
+        self.assertEqual((rows, total, matches), ([1], 2, 1))
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,10 @@
+import StringIO
+import sys
 import unittest
 
+from terminatorlib.tmux import control
+from terminatorlib.tmux import history
+from terminatorlib.tmux import layout
 from terminatorlib.tmux import notifications
 
 
@@ -17,6 +22,398 @@ class NotificationsTests(unittest.TestCase):
             notification.consume(['', layout])
             print notification.window_layout
 
+    def test_closed_panes(self):
+        def window_layout(body):
+            return '{},{}'.format(layout.layout_checksum(body), body)
+
+        terminator = FakeTerminator()
+        handler = notifications.NotificationsHandler(terminator)
+        connect(terminator, handler)
+        handler.initial_layout_result([
+            '@1 ' + window_layout('80x24,0,0{40x24,0,0,1,39x24,41,0,2}'),
+            '@2 ' + window_layout('80x24,0,0,3')])
+        self.assertEqual(handler.closed_pane_ids, set())
+
+        notification = notifications.LayoutChange()
+        notification.consume(['@1', window_layout('80x24,0,0,2')])
+        handler.handle_layout_change(notification)
+        self.assertEqual(handler.closed_pane_ids, set(['%1']))
+
+        notification = notifications.WindowClose()
+        notification.consume(['@2'])
+        handler.handle_window_close(notification)
+        self.assertEqual(handler.closed_pane_ids, set(['%1', '%3']))
+
+
+class LayoutParserTests(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = layout.LayoutParser()
+
+    def test_checksum(self):
+        self.assertEqual(
+            layout.layout_checksum('159x48,0,0{79x48,0,0,79x48,80,0}'),
+            'bb62')
+
+    def test_parse_single_pane(self):
+        pane = self.parser.parse('b25d,80x24,0,0,0')
+        self.assertIsInstance(pane, layout.Pane)
+        self.assertEqual((pane.width, pane.height, pane.x, pane.y),
+                         (80, 24, 0, 0))
+        self.assertEqual(pane.pane_id, '%0')
+
+    def test_parse_nested_containers(self):
+        body = ('80x24,0,0[80x12,0,0,0,80x11,0,13{40x11,0,13,1,'
+                '39x11,41,13,2}]')
+        root = self.parser.parse(layout.layout_checksum(body) + ',' + body)
+        self.assertIsInstance(root, layout.Vertical)
+        first, second = root.children
+        self.assertEqual(first.pane_id, '%0')
+        self.assertIsInstance(second, layout.Horizontal)
+        self.assertEqual([pane.pane_id for pane in second.children],
+                         ['%1', '%2'])
+        self.assertEqual((second.x, second.y), (0, 13))
+
+    def test_parse_deep_nesting(self):
+        depth = 2000
+        body = ''.join('10x10,0,0{' for _ in range(depth)) + \
+            '10x10,0,0,0' + '}' * depth
+        root = self.parser.parse(layout.layout_checksum(body) + ',' + body)
+        for _ in range(depth):
+            self.assertIsInstance(root, layout.Horizontal)
+            root, = root.children
+        self.assertEqual(root.pane_id, '%0')
+
+    def test_parse_invalid(self):
+        for invalid in ['0000,80x24,0,0,0', 'xyz,80x24,0,0,0', '80x24,0,0,0']:
+            self.assertRaises(ValueError, self.parser.parse, invalid)
+        for body in ['80x24,0,0{40x24,0,0,0', '80x24,0,0{40x24,0,0,0]',
+                     '80x24,0,0,0}', '80x24,0,0,0,80x24,0,0,1']:
+            self.assertRaises(ValueError, self.parser.parse,
+                              layout.layout_checksum(body) + ',' + body)
+
+
+class LayoutCacheTests(unittest.TestCase):
+
+    def _layout(self, body):
+        return layout.layout_checksum(body) + ',' + body
+
+    def test_hits_and_misses(self):
+        cache = layout.LayoutCache()
+        window_layout = self._layout('80x24,0,0{40x24,0,0,0,39x24,41,0,1}')
+        tree = cache.parse(window_layout)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        self.assertIs(cache.parse(window_layout), tree)
+        terminator_layout = cache.convert(window_layout)
+        self.assertIs(cache.convert(window_layout), terminator_layout)
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+        self.assertEqual(layout.get_pane_ids(tree), ['%0', '%1'])
+
+    def test_eviction(self):
+        cache = layout.LayoutCache(maxsize=2)
+        layouts = [self._layout('80x24,0,0,{}'.format(pane_id))
+                   for pane_id in range(3)]
+        cache.parse(layouts[0])
+        cache.parse(layouts[1])
+        cache.parse(layouts[0])
+        cache.parse(layouts[2])
+        self.assertEqual(list(cache.entries), [layouts[0], layouts[2]])
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+
+class ConvertToTerminatorLayoutTests(unittest.TestCase):
+
+    def _parse(self, body):
+        return layout.LayoutParser().parse(
+            layout.layout_checksum(body) + ',' + body)
+
+    def test_convert_chain(self):
+        root = self._parse('80x24,0,0{19x24,0,0,0,20x24,20,0,1,'
+                           '39x24,41,0,2}')
+        result = layout.convert_to_terminator_layout([root])
+        self.assertEqual(result['pane0']['parent'], 'window0')
+        self.assertEqual(result['pane1']['parent'], 'pane0')
+        self.assertEqual(result['terminal0']['parent'], 'pane0')
+        self.assertEqual(result['terminal1']['parent'], 'pane1')
+        self.assertEqual(result['terminal2']['parent'], 'pane1')
+        self.assertEqual(result['terminal2']['pane_id'], '%2')
+        self.assertEqual(result['pane0']['type'], 'HPaned')
+        self.assertAlmostEqual(result['pane0']['ratio'], 19 / 79.0)
+        self.assertAlmostEqual(result['pane1']['ratio'], 20 / 59.0)
+        # the first child of each Paned comes first
+        self.assertTrue(result['terminal0']['order'] <
+                        result['pane1']['order'])
+        self.assertTrue(result['terminal1']['order'] <
+                        result['terminal2']['order'])
+
+    def test_convert_windows_to_notebook(self):
+        windows = [self._parse('80x24,0,0,0'),
+                   self._parse('80x24,0,0[80x12,0,0,1,80x11,0,13,2]')]
+        result = layout.convert_to_terminator_layout(windows)
+        self.assertEqual(result['notebook0']['parent'], 'window0')
+        self.assertEqual(result['terminal0']['parent'], 'notebook0')
+        self.assertEqual(result['pane0']['parent'], 'notebook0')
+        self.assertEqual(result['pane0']['type'], 'VPaned')
+        self.assertTrue(result['terminal0']['order'] <
+                        result['pane0']['order'])
+
+    def test_convert_many_panes(self):
+        # nested deeper than the recursion limit, which a recursive
+        # conversion couldn't manage
+        panes = sys.getrecursionlimit() + 100
+        flat = '{}x24,0,0{{{}}}'.format(panes * 2 - 1, ','.join(
+            '1x24,{},0,{}'.format(index * 2, index)
+            for index in range(panes)))
+        nested = ''.join('1000x1000,0,0[1000x1,0,0,{},'.format(index)
+                         for index in range(panes - 1)) + \
+            '1000x1,0,0,{}'.format(panes - 1) + ']' * (panes - 1)
+        for body in [flat, nested]:
+            root = self._parse(body)
+            result = layout.convert_to_terminator_layout([root])
+            terminals = [name for name in result
+                         if result[name]['type'] == 'Terminal']
+            self.assertEqual(len(terminals), panes)
+            self.assertEqual(len(result), 2 * panes)
+
+
+class ConvertToTmuxLayoutTests(unittest.TestCase):
+
+    def test_round_trip(self):
+        parser = layout.LayoutParser()
+        for body in ['80x24,0,0,0',
+                     '80x24,0,0{40x24,0,0,0,39x24,41,0,1}',
+                     '80x24,0,0[80x12,0,0,0,80x5,0,13,1,80x5,0,19{40x5,0,'
+                     '19,2,19x5,41,19,3,9x5,61,19,4,4x5,71,19,5,4x5,76,19,'
+                     '6}]']:
+            window_layout = layout.layout_checksum(body) + ',' + body
+            terminator_layout = layout.convert_to_terminator_layout(
+                [parser.parse(window_layout)])
+            root_name, = [name for name in terminator_layout
+                          if terminator_layout[name]['parent'] == 'window0']
+            self.assertEqual(
+                layout.convert_to_tmux_layout(terminator_layout, root_name,
+                                              80, 24),
+                window_layout)
+
+    def test_ratios(self):
+        terminator_layout = {
+            'child0': {'type': 'VPaned', 'parent': '', 'order': 0,
+                       'ratio': 0.25},
+            'child1': {'type': 'HPaned', 'parent': 'child0', 'order': 1},
+            'terminal2': {'type': 'Terminal', 'parent': 'child0',
+                          'order': 0, 'pane_id': '%2'},
+            'terminal3': {'type': 'Terminal', 'parent': 'child1',
+                          'order': 1, 'pane_id': '%3'},
+            'terminal4': {'type': 'Terminal', 'parent': 'child1',
+                          'order': 0, 'pane_id': '%4'},
+        }
+        result = layout.convert_to_tmux_layout(terminator_layout, 'child0',
+                                               101, 41)
+        self.assertEqual(result.split(',', 1)[1],
+                         '101x41,0,0[101x10,0,0,2,101x30,0,11'
+                         '{50x30,0,11,4,50x30,51,11,3}]')
+        self.assertEqual(layout.LayoutParser().parse(result).height, 41)
+
+
+class FakeVte(object):
+
+    def __init__(self):
+        self.fed = []
+
+    def feed(self, text):
+        self.fed.append(text)
+
+    def reset(self, clear_tabstops, clear_history):
+        self.fed = []
+
+
+class FakeTerminal(object):
+
+    tmux_offscreen = False
+    tmux_missed_output = False
+    tmux_catching_up = False
+    tmux_history = None
+    tmux_history_lines = 0
+    tmux_history_pages = 0
+    tmux_history_size = None
+
+    def __init__(self):
+        self.vte = FakeVte()
+
+    def set_tmux_history(self, pages, lines):
+        self.tmux_history_pages = pages
+        self.tmux_history_lines = lines
+
+    def scroll_to_tmux_history(self, distance):
+        pass
+
+
+class FakeTerminator(object):
+
+    def __init__(self):
+        self.tmux_control = type('FakeControl', (object,), {})()
+        self.pane_id_to_terminal = {}
+        self.pane_id_to_placeholder = {}
+
+
+def connect(terminator, handler):
+    """Give terminator a tmux control writing its commands to a string"""
+    terminator.tmux_control = control.TmuxControl('terminator', handler)
+    terminator.tmux_control.input = StringIO.StringIO()
+    return terminator.tmux_control
+
+
+def make_result(lines, error=False):
+    """Return the result of a tmux command"""
+    result = notifications.Result()
+    result.result = lines
+    result.error = error
+    return result
+
+
+class OffscreenOutputTests(unittest.TestCase):
+
+    def setUp(self):
+        self.terminator = FakeTerminator()
+        self.handler = notifications.NotificationsHandler(self.terminator)
+        self.terminal = FakeTerminal()
+        self.terminator.pane_id_to_terminal['%1'] = self.terminal
+
+    def _output(self, text):
+        notification = notifications.Output()
+        notification.consume(['%1', text])
+        self.handler.handle_output(notification)
+
+    def test_offscreen_output_is_dropped(self):
+        self._output('one')
+        self.terminal.tmux_offscreen = True
+        self._output('two')
+        self.assertEqual(self.terminal.vte.fed, ['one'])
+        self.assertTrue(self.terminal.tmux_missed_output)
+
+    def test_catch_up_replaces_contents(self):
+        self.terminal.tmux_offscreen = True
+        self._output('two')
+        self.terminal.tmux_offscreen = False
+        self.terminal.tmux_catching_up = True
+        self._output('three')
+        captured = {}
+        self.handler.capture_result_callback(captured)(
+            ['one', '', 'two', 'three', ''])
+        self.handler.catch_up_output_result_callback('%1', captured)(['3,5'])
+        self._output('four')
+        # blank lines are kept, and the cursor goes back where it was
+        self.assertEqual(self.terminal.vte.fed,
+                         ['one\r\n\r\ntwo\r\nthree\r\n', '\033[4;6H',
+                          'four'])
+        self.assertFalse(self.terminal.tmux_missed_output)
+
+    def test_catch_up_while_hidden_again(self):
+        self.terminal.tmux_offscreen = True
+        self.terminal.tmux_missed_output = True
+        self.terminal.tmux_catching_up = True
+        captured = {}
+        self.handler.capture_result_callback(captured)(['one'])
+        self.handler.catch_up_output_result_callback('%1', captured)(['0,0'])
+        self.assertEqual(self.terminal.vte.fed, [])
+        self.assertTrue(self.terminal.tmux_missed_output)
+        self.assertFalse(self.terminal.tmux_catching_up)
+
+
+    def test_catch_up_fails(self):
+        tmux = connect(self.terminator, self.handler)
+        self.terminal.tmux_missed_output = True
+        self.terminal.tmux_catching_up = True
+        tmux.catch_up_output('%1')
+        done = []
+        tmux.run_when_done(lambda: done.append(True))
+        # the pane went away, tmux replies to the capture-pane with an
+        # error and never runs the display after it
+        self.handler.handle_begin(make_result(["can't find pane: %1"], True))
+        self.handler.handle_begin(make_result(['']))
+        self.assertEqual(done, [True])
+        self.assertEqual(self.terminal.vte.fed, [])
+        self.assertFalse(self.terminal.tmux_catching_up)
+        self.assertTrue(tmux.requests.empty())
+
+
+class HistoryTests(unittest.TestCase):
+
+    def test_page_range(self):
+        self.assertEqual(history.page_range(0), (-history.PAGE_LINES, -1))
+        self.assertEqual(history.page_range(1),
+                         (-2 * history.PAGE_LINES, -history.PAGE_LINES - 1))
+        # the rows the terminal holds anyway aren't fetched again
+        self.assertEqual(history.page_range(0, 100),
+                         (-100 - history.PAGE_LINES, -101))
+
+    def test_cache_eviction(self):
+        cache = history.HistoryCache(maxsize=2)
+        cache.put(0, ['a'])
+        cache.put(1, ['b'])
+        self.assertEqual(cache.get(0), ['a'])
+        cache.put(2, ['c'])
+        # page 1 was the least recently used one
+        self.assertEqual(cache.get(1), None)
+        self.assertEqual(cache.get(2), ['c'])
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_load_history(self):
+        terminator = FakeTerminator()
+        handler = notifications.NotificationsHandler(terminator)
+        terminal = FakeTerminal()
+        terminal.tmux_history = history.HistoryCache()
+        terminator.pane_id_to_terminal['%1'] = terminal
+        page_size = history.PAGE_LINES
+
+        # page 0 is cached, page 1 is fetched, page 2 is beyond the
+        # history and only holds the line tmux clamped the range to; the
+        # screen comes with the 10 rows above it the terminal keeps anyway
+        terminal.tmux_history.put(0, ['new'] * page_size)
+        fetched = {}
+        handler.history_page_result_callback('%1', 1, fetched)(
+            ['old'] * page_size)
+        handler.history_page_result_callback('%1', 2, fetched)(['old'])
+        handler.history_page_result_callback('%1', 'screen', fetched)(
+            ['recent'] * 10 + ['$ ', ''])
+        handler.history_result_callback('%1', 3, fetched, 0, 10)(
+            ['2 0 {}'.format(2 * page_size + 10)])
+
+        self.assertEqual(terminal.tmux_history_pages, 3)
+        self.assertEqual(terminal.tmux_history_lines, 2 * page_size)
+        self.assertEqual(terminal.tmux_history_size, 2 * page_size + 10)
+        text, cursor = terminal.vte.fed
+        lines = text.split('\r\n')
+        self.assertEqual(len(lines), 2 * page_size + 12)
+        self.assertEqual(lines[0], 'old')
+        self.assertEqual(lines[page_size], 'new')
+        self.assertEqual(lines[2 * page_size], 'recent')
+        self.assertEqual(cursor, '\033[1;3H')
+        self.assertEqual(terminal.tmux_history.get(1), ['old'] * page_size)
+
+    def test_load_history_fails(self):
+        terminator = FakeTerminator()
+        handler = notifications.NotificationsHandler(terminator)
+        tmux = connect(terminator, handler)
+        terminal = FakeTerminal()
+        terminal.tmux_history = history.HistoryCache()
+        terminal.tmux_history_loading = True
+        terminator.pane_id_to_terminal['%1'] = terminal
+
+        tmux.load_history('%1', 3, terminal.tmux_history, 0, 10)
+        done = []
+        tmux.run_when_done(lambda: done.append(True))
+        # the first capture-pane of the sequence fails, so tmux runs none
+        # of the commands after it
+        handler.handle_begin(make_result(["can't find pane: %1"], True))
+        handler.handle_begin(make_result(['']))
+
+        self.assertEqual(done, [True])
+        self.assertEqual(terminal.vte.fed, [])
+        self.assertEqual(terminal.tmux_history.get(0), None)
+        self.assertFalse(terminal.tmux_history_loading)
+        self.assertTrue(tmux.requests.empty())
+
 
 def main():
     unittest.main()